@@ -0,0 +1,392 @@
+import sys
+import os
+import argparse
+import importlib.util
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from multiprocessing import cpu_count
+
+# |**********************************************************************
+# |* Project           : Norman Lab Python 3 BLAST Quality Control Script
+# |*
+# |* Program name      : benchmark.py
+# |*
+# |* Usage             : python benchmark.py {-args}
+# |*
+# |* description       : Benchmarks BLAST-QC.py on large synthetic BLAST results. Seeded generators write XML
+# |*                     (outfmt 5) and tabular (outfmt 6 std salltitles) results of a chosen size. Each option
+# |*                     case is timed stage by stage in-process (split, parse, thresholds, order_hits, write) and
+# |*                     end to end as a separate process (wall time, cpu time and peak RSS). Results can be saved
+# |*                     as JSON and compared with an earlier run to catch regressions between commits.
+# |*
+# |**********************************************************************
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BLAST-QC.py')
+
+# Option cases that are timed, by name
+CASES = {
+    'all':        [],
+    'top1':       ['-n', '1'],
+    'top10':      ['-n', '10'],
+    'order-b':    ['-n', '10', '-or', 'b'],
+    'order-i':    ['-n', '10', '-or', 'i'],
+    'order-d':    ['-n', '10', '-or', 'd'],
+    'erange':     ['-n', '5', '-or', 'e', '-er', '1e-5'],
+    'brange':     ['-n', '5', '-or', 'b', '-br', '5'],
+    'irange':     ['-n', '5', '-or', 'i', '-ir', '2'],
+    'thresholds': ['-e', '1e-5', '-b', '40', '-i', '50', '-d', '2'],
+}
+
+WORDS = ['hypothetical', 'protein', 'transporter', 'ATP-binding', 'subunit', 'putative', 'kinase', 'domain',
+         'family', 'membrane', 'regulator', 'transcriptional', 'dehydrogenase', 'reductase', 'synthase', 'unknown']
+GENERA = ['Salinibacter', 'Cyclobacterium', 'Pseudomonas', 'Bacillus', 'Streptomyces', 'Vibrio', 'Escherichia']
+
+
+# Synthetic data. Every query has 0 to 2x'hits' hits (so 'hits' on average), each with 1 to 2x'hsps'-1 HSPs, listed
+# by increasing evalue as BLAST does. Definitions hold several titles of about 'deflength' characters in total, so
+# the level of definition varies between hits.
+class Generator:
+    def __init__(self, queries, hits, hsps, deflength, seed):
+        self.queries = queries
+        self.hits = hits
+        self.hsps = hsps
+        self.deflength = deflength
+        self.seed = seed
+
+    def name(self):
+        return 'q{}_h{}_s{}_d{}_seed{}'.format(self.queries, self.hits, self.hsps, self.deflength, self.seed)
+
+    def titles(self, rng, accession):
+        titles = []
+        length = 0
+        while length < self.deflength or len(titles) == 0:
+            title = '{} {} [{} sp. {}]'.format(' '.join(rng.choice(WORDS) for i in range(rng.randint(2, 5))),
+                                               accession, rng.choice(GENERA), rng.randint(1, 99))
+            titles.append(title)
+            length += len(title)
+            if rng.random() < 0.4:
+                break
+        return titles
+
+    def query(self, rng):
+        # The length of one query and its hits as (gi, accession, subject length, titles, [hsp, ...]) with hsp
+        # values as a dict. Both formats draw the same queries for the same seed.
+        length = rng.randint(100, 600)
+        hits = []
+        for h in range(rng.randint(0, 2 * self.hits)):
+            gi = rng.randint(1, 10 ** 10)
+            accession = 'WP_{:09d}'.format(rng.randint(1, 10 ** 9))
+            hsps = []
+            for s in range(rng.randint(1, 2 * self.hsps - 1)):
+                align_len = rng.randint(20, 400)
+                identity = rng.randint(align_len // 4, align_len)
+                exponent = rng.uniform(0, 60)
+                hsps.append({'evalue': float('%.2g' % 10 ** -exponent) if exponent < 59 else 0.0,
+                             'bitscore': round(20 + exponent * 4 + rng.uniform(0, 10), 1),
+                             'align_len': align_len, 'identity': identity,
+                             'positive': min(align_len, identity + rng.randint(0, align_len // 4)),
+                             'query_start': rng.randint(1, 50), 'hit_start': rng.randint(1, 500),
+                             'frame': rng.choice([1, 2, 3, -1, -2, -3])})
+            hsps.sort(key=lambda hsp: hsp['evalue'])
+            hits.append((gi, accession, rng.randint(100, 3000), self.titles(rng, accession), hsps))
+        hits.sort(key=lambda hit: hit[4][0]['evalue'])
+        return length, hits
+
+    def write_xml(self, path):
+        rng = random.Random(self.seed)
+        count = 0
+        with open(path, 'w') as out:
+            out.write('<?xml version="1.0"?>\n<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" '
+                      '"http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">\n<BlastOutput>\n'
+                      '  <BlastOutput_program>blastx</BlastOutput_program>\n<BlastOutput_iterations>\n')
+            for q in range(1, self.queries + 1):
+                query_length, hits = self.query(rng)
+                rows = ['<Iteration>\n  <Iteration_iter-num>{0}</Iteration_iter-num>\n'
+                        '  <Iteration_query-ID>Query_{0}</Iteration_query-ID>\n'
+                        '  <Iteration_query-def>M01535:64:000000000-AYEHH:1:1101:{0}:1498 1:N:0:ATTCAA</Iteration_query-def>\n'
+                        '  <Iteration_query-len>{1}</Iteration_query-len>\n<Iteration_hits>\n'.format(q, query_length)]
+                for num, (gi, accession, length, titles, hsps) in enumerate(hits, 1):
+                    rows.append('<Hit>\n  <Hit_num>{}</Hit_num>\n  <Hit_id>gi|{}|ref|{}.1|</Hit_id>\n  <Hit_def>{}</Hit_def>\n'
+                                '  <Hit_accession>{}</Hit_accession>\n  <Hit_len>{}</Hit_len>\n  <Hit_hsps>\n'.format(
+                                    num, gi, accession, ' &gt;'.join(titles), accession, length))
+                    for s, hsp in enumerate(hsps, 1):
+                        rows.append('    <Hsp>\n      <Hsp_num>{}</Hsp_num>\n      <Hsp_bit-score>{}</Hsp_bit-score>\n'
+                                    '      <Hsp_score>{}</Hsp_score>\n      <Hsp_evalue>{}</Hsp_evalue>\n'
+                                    '      <Hsp_query-from>{}</Hsp_query-from>\n      <Hsp_query-to>{}</Hsp_query-to>\n'
+                                    '      <Hsp_hit-from>{}</Hsp_hit-from>\n      <Hsp_hit-to>{}</Hsp_hit-to>\n'
+                                    '      <Hsp_query-frame>{}</Hsp_query-frame>\n      <Hsp_hit-frame>0</Hsp_hit-frame>\n'
+                                    '      <Hsp_identity>{}</Hsp_identity>\n      <Hsp_positive>{}</Hsp_positive>\n'
+                                    '      <Hsp_gaps>0</Hsp_gaps>\n      <Hsp_align-len>{}</Hsp_align-len>\n    </Hsp>\n'.format(
+                                        s, hsp['bitscore'], int(hsp['bitscore'] * 2.5), hsp['evalue'],
+                                        hsp['query_start'], hsp['query_start'] + hsp['align_len'] - 1,
+                                        hsp['hit_start'], hsp['hit_start'] + hsp['align_len'] // 3,
+                                        hsp['frame'], hsp['identity'], hsp['positive'], hsp['align_len']))
+                        count += 1
+                    rows.append('  </Hit_hsps>\n</Hit>\n')
+                rows.append('</Iteration_hits>\n</Iteration>\n')
+                out.write(''.join(rows))
+            out.write('</BlastOutput_iterations>\n</BlastOutput>\n')
+        return count
+
+    def write_tab(self, path):
+        rng = random.Random(self.seed)
+        count = 0
+        with open(path, 'w') as out:
+            for q in range(1, self.queries + 1):
+                rows = []
+                for gi, accession, length, titles, hsps in self.query(rng)[1]:
+                    for hsp in hsps:
+                        rows.append('Query_{}\tgi|{}|ref|{}.1|\t{:.3f}\t{}\t{}\t0\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                            q, gi, accession, 100 * hsp['identity'] / hsp['align_len'],
+                            hsp['align_len'], hsp['align_len'] - hsp['identity'],
+                            hsp['query_start'], hsp['query_start'] + hsp['align_len'] - 1,
+                            hsp['hit_start'], hsp['hit_start'] + hsp['align_len'] // 3,
+                            hsp['evalue'], hsp['bitscore'], '<>'.join(titles)))
+                        count += 1
+                out.write(''.join(rows))
+        return count
+
+    def dataset(self, workdir, fileformat):
+        # Writes the results file once and reuses it while the same sizes and seed are asked for
+        path = os.path.join(workdir, '{}.{}'.format(self.name(), 'xml' if fileformat == "XML" else 'tsv'))
+        counts = path + '.json'
+        if not (os.path.exists(path) and os.path.exists(counts)):
+            hsps = self.write_xml(path) if fileformat == "XML" else self.write_tab(path)
+            with open(counts, 'w') as counts_file:
+                json.dump({'queries': self.queries, 'hsps': hsps}, counts_file)
+        with open(counts) as counts_file:
+            return path, json.load(counts_file)
+
+
+# The code of BLAST-QC.py is in the module 'blastqc.py' next to it (BLAST-QC.py itself in older trees, which cannot
+# be imported by name), so it is loaded from its path
+def load_script(path):
+    library = os.path.join(os.path.dirname(os.path.abspath(path)), 'blastqc.py')
+    if os.path.exists(library):
+        path = library
+    spec = importlib.util.spec_from_file_location('blastqc_script', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def script_options(module, args):
+    # The options BLAST-QC.py would run with for these command line args
+    argv = sys.argv
+    sys.argv = ['BLAST-QC.py'] + args
+    try:
+        return module.BLASTQC().clOptions
+    finally:
+        sys.argv = argv
+
+
+def time_stages(module, options):
+    # Runs the sequential pipeline in-process and times every stage on its own
+    qc = module.BLASTQC(options)
+    qc.output = module.ResultWriter(options)
+    times = {}
+    clock = time.perf_counter
+
+    def add(stage, since):
+        now = clock()
+        times[stage] = times.get(stage, 0.0) + now - since
+        return now
+
+    start = clock()
+    with open(options.filename, 'rb') as source:
+        if options.fileformat == "XML":
+            iterations = qc.iterate_xml_raw(source)
+            while True:
+                now = clock()
+                raw = next(iterations, None)
+                now = add('split', now)
+                if raw is None:
+                    break
+                cur_query, hits = qc.extract_iteration(ET.fromstring(raw))
+                now = add('parse', now)
+                cur_query.hits = qc.apply_thresholds(hits)
+                now = add('thresholds', now)
+                qc.order_hits(cur_query)
+                now = add('order_hits', now)
+                qc.write_query(cur_query)
+                add('write', now)
+        else:
+            chunks = qc.iterate_tab(source)
+            while True:
+                now = clock()
+                chunk = next(chunks, None)
+                now = add('read', now)
+                if chunk is None:
+                    break
+                block = qc.process_tab_chunk(chunk)
+                now = add('filter_rank', now)
+                qc.write_block(block)
+                add('write', now)
+    qc.output.close()
+    times['total'] = clock() - start
+    return times
+
+
+# Runs a script (argv[2:]) and writes its peak RSS in KB to the file argv[1] as it exits: the VmHWM of the process or
+# the largest peak of its worker processes. The ru_maxrss of a process started by the harness is no use, as it
+# carries the peak RSS of the harness over fork and exec.
+PEAK_RSS_RUNNER = '''
+import os, resource, runpy, sys
+report = sys.argv[1]
+sys.argv = sys.argv[2:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    with open('/proc/self/status') as status:
+        own = [int(line.split()[1]) for line in status if line.startswith('VmHWM:')]
+    with open(report, 'w') as report_file:
+        report_file.write(str(max(own + [resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss])))
+'''
+
+
+def run_script(script, args):
+    # Runs BLAST-QC.py as its own process. The peak RSS is that of the largest process (the main process or one of
+    # its workers), as reported by the process itself (see PEAK_RSS_RUNNER).
+    descriptor, report = tempfile.mkstemp(suffix='.rss')
+    os.close(descriptor)
+    try:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', PEAK_RSS_RUNNER, report, script] + args,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        pid, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        if status != 0:
+            raise RuntimeError('BLAST-QC.py {} failed:\n{}'.format(' '.join(args), stderr.decode(errors='replace')))
+        with open(report) as report_file:
+            peak_rss = int(report_file.read())
+    finally:
+        os.remove(report)
+    return {'wall': wall, 'cpu': usage.ru_utime + usage.ru_stime, 'peak_rss_kb': peak_rss}
+
+
+def git_commit(path):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(path),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return '{} {} {} p={}'.format(result['kind'], result['format'], result['case'], result.get('parallel', 1))
+
+
+def compare(old, new, tolerance):
+    # Prints the wall times of the results both runs have in common. Returns the keys that got slower by more than
+    # 'tolerance' (a fraction).
+    old_results = {result_key(result): result for result in old['results']}
+    slower = []
+    print('\n{:<40} {:>10} {:>10} {:>8}'.format('compared with ' + str(old['meta'].get('commit')), 'old (s)', 'new (s)', 'ratio'))
+    for result in new['results']:
+        key = result_key(result)
+        if key not in old_results:
+            continue
+        before = old_results[key]['wall']
+        after = result['wall']
+        ratio = after / before if before > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  slower'
+            slower.append(key)
+        print('{:<40} {:>10.3f} {:>10.3f} {:>8.2f}{}'.format(key, before, after, ratio, flag))
+    return slower
+
+
+def CLI():
+    parser = argparse.ArgumentParser(description="Benchmark BLAST-QC.py on synthetic BLAST results.")
+    parser.add_argument("-q", "--queries", help="Number of queries in the generated results.\n(Int value)", type=int, default=2000)
+    parser.add_argument("-H", "--hits", help="Average number of hits per query.\n(Int value)", type=int, default=20)
+    parser.add_argument("-s", "--hsps", help="Average number of HSPs per hit.\n(Int value)", type=int, default=2)
+    parser.add_argument("-dl", "--deflength", help="Approximate length of a hit definition in characters.\n(Int value)",
+                        type=int, default=120)
+    parser.add_argument("--seed", help="Seed of the generators.\n(Int value)", type=int, default=1)
+    parser.add_argument("-ff", "--fileformat", help="Formats to benchmark.", nargs='+', choices=["XML", "tab"],
+                        default=["XML", "tab"])
+    parser.add_argument("-c", "--cases", help="Option cases to benchmark (default all): " + ', '.join(CASES),
+                        nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument("-p", "--parallel", help="Worker process counts for the end to end runs.", nargs='+', type=int,
+                        default=sorted({1, cpu_count()}))
+    parser.add_argument("-r", "--repeat", help="Runs per measurement, the fastest is kept.\n(Int value)", type=int, default=1)
+    parser.add_argument("--nostages", help="Skip the in-process stage timings.", action="store_true")
+    parser.add_argument("--norun", help="Skip the end to end runs.", action="store_true")
+    parser.add_argument("-w", "--workdir", help="Directory for generated data and outputs.", type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.data'))
+    parser.add_argument("--script", help="BLAST-QC.py to benchmark.", type=str, default=SCRIPT)
+    parser.add_argument("-j", "--json", help="Save the results to this JSON file.", type=str)
+    parser.add_argument("--compare", help="Compare with results saved by an earlier run (JSON file).", type=str)
+    parser.add_argument("--tolerance", help="Fraction by which a wall time may grow before it is reported as slower "
+                        "when comparing.\n(Float value)", type=float, default=0.10)
+    return parser.parse_args()
+
+
+def main():
+    args = CLI()
+    os.makedirs(args.workdir, exist_ok=True)
+    generator = Generator(args.queries, args.hits, args.hsps, args.deflength, args.seed)
+    module = load_script(args.script)
+    if hasattr(module, 'load_optional'):
+        module.load_optional('numpy', 'np')
+    output = os.path.join(args.workdir, 'out')
+    results = []
+    datasets = {}
+
+    for fileformat in args.fileformat:
+        start = time.perf_counter()
+        path, counts = generator.dataset(args.workdir, fileformat)
+        datasets[fileformat] = dict(counts, path=path, bytes=os.path.getsize(path))
+        print('{}: {} queries, {} HSPs, {:.1f} MB ({:.1f}s to prepare)'.format(
+            fileformat, counts['queries'], counts['hsps'], os.path.getsize(path) / 1e6, time.perf_counter() - start))
+
+        for case in args.cases:
+            base = ['-f', path, '-ff', fileformat, '-t', 'p', '-o', output] + CASES[case]
+            if not args.nostages:
+                options = script_options(module, base + ['-p', '1'])
+                stages = min((time_stages(module, options) for i in range(args.repeat)), key=lambda t: t['total'])
+                results.append({'kind': 'stages', 'format': fileformat, 'case': case, 'wall': stages['total'],
+                                'stages': stages})
+                print('  {:<11} stages   {}'.format(case, '  '.join(
+                    '{} {:.3f}s'.format(stage, seconds) for stage, seconds in stages.items())))
+            if not args.norun:
+                for parallel in args.parallel:
+                    run = min((run_script(args.script, base + ['-p', str(parallel)]) for i in range(args.repeat)),
+                              key=lambda r: r['wall'])
+                    run.update({'kind': 'run', 'format': fileformat, 'case': case, 'parallel': parallel,
+                                'queries_per_sec': counts['queries'] / run['wall'],
+                                'hsps_per_sec': counts['hsps'] / run['wall']})
+                    results.append(run)
+                    print('  {:<11} -p {:<4}  {:.3f}s wall  {:.3f}s cpu  {:>9.0f} queries/s  {:>10.0f} HSPs/s  {:>7} KB peak RSS'.format(
+                        case, parallel, run['wall'], run['cpu'], run['queries_per_sec'], run['hsps_per_sec'],
+                        run['peak_rss_kb']))
+
+    report = {'meta': {'commit': git_commit(args.script), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(), 'numpy': getattr(module.np, '__version__', None),
+                       'cpus': cpu_count(), 'platform': platform.platform(),
+                       'generator': {'queries': args.queries, 'hits': args.hits, 'hsps': args.hsps,
+                                     'deflength': args.deflength, 'seed': args.seed},
+                       'datasets': datasets},
+              'results': results}
+    if args.json != None:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=1)
+
+    if args.compare != None:
+        with open(args.compare) as json_file:
+            slower = compare(json.load(json_file), report, args.tolerance)
+        if len(slower) != 0:
+            print('\n{} measurement(s) slower by more than {:.0%}'.format(len(slower), args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
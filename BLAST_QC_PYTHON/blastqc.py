@@ -0,0 +1,3762 @@
+import sys
+import os
+import io
+import importlib
+import copy
+import xml.etree.ElementTree as ET
+import heapq
+import bisect
+import json
+import hashlib
+import mmap
+import shutil
+import gzip
+import zlib
+import queue
+import threading
+from collections import deque, OrderedDict
+from itertools import chain, islice, takewhile
+from array import array
+import traceback
+from contextlib import nullcontext
+from time import perf_counter, process_time
+
+# NumPy is optional. When it is available tabular results are filtered and ranked column-wise (see TabularChunk)
+# and the parse cache can be used (see ParseCache), otherwise results are handled line by line.
+# zstd compressed input and output use the 'zstandard' module if it is installed. Without it zstd input is
+# decompressed by the 'zstd' command and zstd output is not available.
+# Parquet output uses the 'pyarrow' module.
+# These are imported the first time they are needed (see 'load_optional'), like the other modules only some runs
+# use (argparse, multiprocessing, subprocess, sqlite3), so importing BLAST-QC as a library stays cheap.
+np = None
+zstandard = None
+pa = None
+pq = None
+missing_modules = set()
+
+def load_optional(module, name=None):
+    # Imports the optional 'module' into the global 'name' (the module name by default) unless it has been
+    # already. Returns False if the module is not installed.
+    name = module if name is None else name
+    if globals()[name] is None and module not in missing_modules:
+        try:
+            globals()[name] = importlib.import_module(module)
+        except ImportError:
+            missing_modules.add(module)
+    return globals()[name] is not None
+
+# 'resource' (peak memory in the '--stats' report) is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# |**********************************************************************
+# |* Project           : Norman Lab Python 3 BLAST Quality Control Script
+# |*
+# |* Program name      : BLAST-QC.py
+# |*
+# |* Author            : Spencer Hann, Ben Torkian, Sean Norman
+# |*
+# |* Date created      : 07/18/2019
+# |*
+# |* Usage             : python BLAST-QC.py {-args}
+# |*
+# |* Args              : -h {help} -f {infile} -o {outfile} -t {BLAST type}
+# |*                     -n {number of hits} -e {evalue threshold} -b {bit-score threshold}
+# |*                     -i {% identity threshold} -d {definition threshold} -or {order by}
+# |*                     -er {evalue range} -br {bit-score range} -ir {% identity range}
+# |*
+# |* description       : This script is designed to quality control BLAST XML results (BLAST -outfmt 5).
+# |*                     Results will be filtered based on user input in the form of command-line args,
+# |*                     and the best N matching hits with all relevant info are output in a tabular format-
+# |*                     for import into a spreadsheet program for analysis.
+# |*
+# |* License:            This program is free software: you can redistribute it and/or modify
+# |*                     it under the terms of the MIT License as published by
+# |*                     the Open Source Initiative. 'https://opensource.org/licenses/MIT'
+# |*
+# |* Revision History  :
+# |*
+# |* |Date:|        |Author:|      |Ref:|    |Revision:|
+# |*
+# |*
+# |**********************************************************************
+
+
+class Subject:
+    # Values of a subject sequence (<Hit> in BLAST XML output). These are shared by all of its HSPs rather than
+    # copied into each one.
+    __slots__ = ('id', 'def_', 'deflevel', 'accession', 'length', 'deflevels', 'file_id')
+
+    def __init__(self, id=None, def_=None, deflevel=0, accession=None, length=0, deflevels=(0, 0), file_id=None):
+        self.id = id                # <Hit_id>
+        self.def_ = def_            # <Hit_def>
+        self.deflevel = deflevel    # Quantifies the level of information in <Hit_def>
+        self.accession = accession  # <Hit_accession>
+        self.length = length        # <Hit_len>
+        self.deflevels = deflevels  # deflevel for both blast types (n, p), for the parse cache
+        self.file_id = file_id      # Id in the subjects file of '--subjectfile', set when first written
+
+    def __reduce__(self):
+        return Subject, (self.id, self.def_, self.deflevel, self.accession, self.length, self.deflevels,
+                         self.file_id)
+
+
+class SubjectTable:
+    # Interns the subjects of a run by subject id (<Hit_id>, or sseqid in tabular results), so that a subject hit by
+    # many queries is kept once and its deflevels are counted once. Only the 'size' most recently used subjects are
+    # kept ('--subjectcache'); 0 turns interning off. Ids are only unique within a database, so a subject whose
+    # description, accession or length differ from the kept one replaces it.
+    def __init__(self, size, type_):
+        self.size = size
+        self.type = 0 if type_ == 'n' else 1
+        self.subjects = OrderedDict()
+
+    @staticmethod
+    def deflevels(def_):
+        # deflevel is defined by the count of the delimiters of the definition (different with blast type), as with
+        # each one there is an increase in the level of detail in the definition of the hit. Both are kept, as the
+        # parse cache holds the deflevel of either type.
+        if def_ is None:
+            return (0, 0)
+        return (1 + def_.count(';'), 1 + def_.count('>'))
+
+    def get(self, id, def_, accession=None, length=0):
+        subject = self.subjects.get(id)
+        if subject is not None and subject.def_ == def_ and subject.accession == accession and subject.length == length:
+            self.subjects.move_to_end(id)
+            return subject
+        deflevels = self.deflevels(def_)
+        subject = Subject(id, def_, deflevels[self.type], accession, length, deflevels)
+        if self.size != 0:
+            self.subjects[id] = subject
+            self.subjects.move_to_end(id)
+            if len(self.subjects) > self.size:
+                self.subjects.popitem(last=False)
+        return subject
+
+
+class Hit:
+    # A single HSP. Each HSP is treated as a separate hit; the values of its subject are read through 'subject'.
+    # '__slots__' keeps the instances small, as there is one per HSP.
+    __slots__ = ('subject', 'bitscore', 'score', 'evalue', 'query_start', 'query_end', 'hit_start', 'hit_end',
+                 'query_frame', 'identity', 'align_len', 'positive', 'p_identity', 'p_conserved', 'line')
+
+    def __init__(self, subject, bitscore=0.0, score=0, evalue=0.0, query_start=0, query_end=0, hit_start=0,
+                 hit_end=0, query_frame=0, identity=0, align_len=0, positive=0, p_identity=0.0, p_conserved=0.0,
+                 line=None):        # Tag in BLAST XML output
+        self.subject = subject          # <Hit>
+        self.bitscore = bitscore        # <Hsp_bitscore>
+        self.score = score              # <Hsp_score>
+        self.evalue = evalue            # <Hsp_evalue>
+        self.query_start = query_start  # <Hsp_query-from>
+        self.query_end = query_end      # <Hsp_query-to>
+        self.hit_start = hit_start      # <Hsp_hit-from>
+        self.hit_end = hit_end          # <Hsp_hit-to>
+        self.query_frame = query_frame  # <Hsp_query-frame>
+        self.identity = identity        # <Hsp_identity>
+        self.align_len = align_len      # <Hsp_align-len>
+        self.positive = positive        # <Hsp_positive>
+        self.p_identity = p_identity    # 100*(<Hsp_identity>/<Hsp_align-len>)
+        self.p_conserved = p_conserved  # 100*(<Hsp_positive>/<Hsp_align-len>)
+        self.line = line                # The raw line of the hit (tabular)
+
+    def __reduce__(self):
+        # Hits are pickled as their constructor arguments, which is much faster than the default for classes with
+        # '__slots__' (results of worker processes, see HitRuns)
+        return Hit, (self.subject, self.bitscore, self.score, self.evalue, self.query_start, self.query_end,
+                     self.hit_start, self.hit_end, self.query_frame, self.identity, self.align_len, self.positive,
+                     self.p_identity, self.p_conserved, self.line)
+
+    @property
+    def id(self):
+        return self.subject.id
+
+    @property
+    def def_(self):
+        return self.subject.def_
+
+    @property
+    def deflevel(self):
+        return self.subject.deflevel
+
+    @property
+    def accession(self):
+        return self.subject.accession
+
+    @property
+    def length(self):
+        return self.subject.length
+
+
+class Query:
+    __slots__ = ('id', 'num', 'def_', 'length', 'hits')
+
+    def __init__(self):
+        self.id = None          # qseqid (tabular)
+        self.num = 0            # <Iteration_iter-num>
+        self.def_ = None        # <Iteration_query-def>
+        self.length = 0         # <Iteration_query-len>
+        self.hits = []          # Holds a list of all hits for that query
+
+
+# Output sinks. Every sink takes already formatted text and offers the same small interface ('write', 'flush' and
+# 'close'), so the result writer does not need to know where its rows end up. New kinds of sinks (compressed files,
+# sockets, ...) only need to be added to 'open_sink'.
+class FileSink:
+    # A file that stays open for the whole run and is written through a large buffer. Given a size the file is
+    # truncated to that size and appended to, to resume a run (see Checkpoint).
+    def __init__(self, path, buffer_size, size=None):
+        self.path = path
+        if size is None:
+            self.file = open(path, 'w', buffering=buffer_size)
+        else:
+            os.truncate(path, size)
+            self.file = open(path, 'a', buffering=buffer_size)
+
+    def write(self, text):
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        # Writes everything to disk and returns the size of the file
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+
+class StdoutSink:
+    def __init__(self, buffer_size):
+        self.file = sys.stdout
+
+    def write(self, text):
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+
+
+class NullSink:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CompressedSink:
+    # A result file written compressed with gzip or zstd ('--outcompress'). Text is gathered into blocks of about
+    # 'buffer_size' characters, which a background thread compresses and writes (zlib and zstandard release the
+    # GIL), so compression overlaps with filtering. 'sync' ends the current gzip member or zstd frame: the file up to
+    # that point is complete on its own and a resumed run can append new members to it (see Checkpoint).
+    def __init__(self, path, buffer_size, kind, size=None):
+        self.path = path
+        self.kind = kind
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        if size is None:
+            self.file = open(path, 'wb')
+        else:
+            os.truncate(path, size)
+            self.file = open(path, 'ab')
+        self.compressor = self.new_compressor()
+        self.error = None
+        self.tasks = queue.Queue(4)
+        self.thread = threading.Thread(target=self.compress, daemon=True)
+        self.thread.start()
+
+    def new_compressor(self):
+        if self.kind == 'gzip':
+            return zlib.compressobj(6, zlib.DEFLATED, 31)
+        return zstandard.ZstdCompressor().compressobj()
+
+    def compress(self):
+        # Runs in the background thread. A task is a block of data, 'flush' (make everything written so far
+        # readable), 'end' (end the member or frame) or None (end it and stop).
+        while True:
+            task = self.tasks.get()
+            try:
+                if self.error is not None:
+                    pass
+                elif isinstance(task, bytes):
+                    self.file.write(self.compressor.compress(task))
+                elif task == 'flush':
+                    mode = zlib.Z_SYNC_FLUSH if self.kind == 'gzip' else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+                    self.file.write(self.compressor.flush(mode))
+                    self.file.flush()
+                else:
+                    self.file.write(self.compressor.flush())
+                    self.compressor = self.new_compressor()
+                    self.file.flush()
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.tasks.task_done()
+            if task is None:
+                return
+
+    def submit(self, task=False):
+        if self.pending_size != 0:
+            self.tasks.put(''.join(self.pending).encode())
+            self.pending = []
+            self.pending_size = 0
+        if task is not False:
+            self.tasks.put(task)
+
+    def wait(self):
+        self.tasks.join()
+        if self.error is not None:
+            raise self.error
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.buffer_size:
+            self.submit()
+
+    def flush(self):
+        self.submit('flush')
+        self.wait()
+
+    def sync(self):
+        self.submit('end')
+        self.wait()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        if self.thread.is_alive():
+            self.submit(None)
+            self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+def open_sink(path, buffer_size, size=None, compress=None):
+    if path == '-':
+        return StdoutSink(buffer_size)
+    if compress != None:
+        return CompressedSink(path, buffer_size, compress, size)
+    return FileSink(path, buffer_size, size)
+
+
+class StageTimer:
+    # Adds the wall and CPU time spent inside a 'with' block to one stage of a Stats. Timers are not re-entrant, a
+    # stage must not be entered again while it is being timed.
+    __slots__ = ('stages', 'name', 'wall', 'cpu')
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.wall = perf_counter()
+        self.cpu = process_time()
+
+    def __exit__(self, *exc):
+        totals = self.stages.get(self.name)
+        if totals is None:
+            totals = self.stages[self.name] = [0.0, 0.0, 0]
+        totals[0] += perf_counter() - self.wall
+        totals[1] += process_time() - self.cpu
+        totals[2] += 1
+
+
+class Stats:
+    # Instrumentation for '--stats': the wall and CPU time of each stage of a run, and counts of the queries and HSPs
+    # seen and of the HSPs dropped by each threshold. When disabled 'stage' returns a shared do-nothing timer and
+    # nothing is counted, so the calls are left in place in the hot paths. Worker processes keep their own Stats and
+    # hand what they recorded back with each batch (see 'take' and 'merge').
+    NO_TIMER = nullcontext()
+    COUNTERS = ('queries', 'hsps', 'hsps_kept', 'dropped_evalue', 'dropped_bitscore', 'dropped_identity',
+                'dropped_deflevel')
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}    # stage: [wall seconds, CPU seconds, calls]
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.timers = {}
+        self.started = None
+
+    def stage(self, name):
+        if not self.enabled:
+            return self.NO_TIMER
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = StageTimer(self.stages, name)
+        return timer
+
+    def timed(self, items, name):
+        # Iterates over 'items', adding the time taken to produce each item to stage 'name'
+        if not self.enabled:
+            return items
+        return self.iterate_timed(iter(items), self.stage(name))
+
+    def iterate_timed(self, items, timer):
+        while True:
+            with timer:
+                item = next(items, timer)
+            if item is timer:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def count_thresholds(self, hits, kept, options):
+        # Counts for 'apply_thresholds', given the number of HSPs kept. An HSP is counted as dropped by every
+        # threshold it fails.
+        counters = self.counters
+        counters['queries'] += 1
+        counters['hsps'] += len(hits)
+        counters['hsps_kept'] += kept
+        if kept != len(hits):
+            counters['dropped_evalue'] += sum(1 for hit in hits if not hit.evalue <= options.evalue)
+            counters['dropped_bitscore'] += sum(1 for hit in hits if not hit.bitscore >= options.bitscore)
+            counters['dropped_identity'] += sum(1 for hit in hits if not hit.p_identity >= options.identity)
+            counters['dropped_deflevel'] += sum(1 for hit in hits if not hit.subject.deflevel >= options.definition)
+
+    def take(self):
+        # What was recorded since the last call, for sending back from a worker process
+        if not self.enabled:
+            return None
+        taken = (self.stages, self.counters)
+        self.stages = {}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        for timer in self.timers.values():
+            timer.stages = self.stages
+        return taken
+
+    def merge(self, taken):
+        # Adds the stages and counters recorded by a worker process. Stage times are summed over all the workers.
+        if taken is None:
+            return
+        stages, counters = taken
+        for name, (wall, cpu, calls) in stages.items():
+            totals = self.stages.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+        for name, n in counters.items():
+            self.counters[name] += n
+
+    def start(self):
+        self.started = (perf_counter(), process_time(), children_cpu())
+
+    def report(self, options, outputs):
+        # The JSON report of the run, given the output base names and the rows written to each. Memory is the peak
+        # resident set size in KiB of this process and of the largest worker process.
+        wall, cpu, children = self.started
+        report = {'input': options.filename if options.files == None else options.files,
+                  'fileformat': options.fileformat, 'parallel': options.parallel,
+                  'wall_seconds': perf_counter() - wall,
+                  'cpu_seconds': {'main': process_time() - cpu, 'workers': children_cpu() - children},
+                  'peak_rss_kib': {'main': peak_rss('RUSAGE_SELF'), 'workers': peak_rss('RUSAGE_CHILDREN')},
+                  'stages': {name: {'wall_seconds': totals[0], 'cpu_seconds': totals[1], 'calls': totals[2]}
+                             for name, totals in self.stages.items()},
+                  'counters': dict(self.counters),
+                  'outputs': [{'output': name, 'hits': rows[0], 'nohits': rows[1]} for name, rows in outputs]}
+        report['counters']['rows_written'] = sum(sum(rows) for name, rows in outputs)
+
+        text = json.dumps(report, indent=2) + '\n'
+        if options.stats == '-':
+            sys.stderr.write(text)
+        else:
+            with open(options.stats, 'w') as stats_file:
+                stats_file.write(text)
+
+
+def children_cpu():
+    # CPU time used by the worker processes that have finished
+    if resource is None:
+        times = os.times()
+        return times.children_user + times.children_system
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss(who):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    if resource is None:
+        return None
+    rss = resource.getrusage(getattr(resource, who)).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class ResultWriter:
+    # Writes the three result files ({}.hits.txt, {}.nohits.txt and {}.hits.header). The sinks are opened (and
+    # truncated) once and kept open for the whole run; the rows of each query are formatted together and handed to
+    # the sinks in a single write. An output base name of '-' writes the hits to stdout and drops the other two files.
+    # With '--flush' the files are flushed after the results of every query (or chunk of tabular lines), with
+    # '--outcompress' they are written compressed (see CompressedSink). With '--subjectfile' every subject is written
+    # once to {}.subjects and the header file refers to it by its id (see 'subject_id'). To resume a run
+    # 'sizes' gives the size of each file at the checkpoint (see Checkpoint); the files are appended to from there.
+    XML_ROW = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}%\t{}%\n'
+    WRITE_HITS = 1 << 16
+
+    def __init__(self, options, sizes=None):
+        self.fileformat = options.fileformat
+        self.name = options.output
+        self.autoflush = options.flush
+        self.rows = [0, 0]      # Hit rows and no hit rows written, for the '--stats' report
+        self.subjects = NullSink()
+        self.listed = None      # Ids of the subjects already in the subjects file ('--subjectfile')
+        if options.output == '-':
+            self.hits = open_sink('-', options.outbuffer)
+            self.nohits = NullSink()
+            self.header = NullSink()
+        else:
+            paths = [options.output + suffix for suffix in result_suffixes(options)]
+            sinks = [open_sink(path, options.outbuffer, sizes[path] if sizes is not None else None, options.outcompress)
+                     for path in paths]
+            self.hits, self.nohits, self.header = sinks[:3]
+            if options.subjectfile:
+                self.subjects = sinks[3]
+                self.listed = set()
+                if sizes is not None:
+                    self.listed.update(read_subjects(paths[3], options.outcompress))
+        if sizes is not None:
+            return
+
+        if self.fileformat == "XML":
+            self.hits.write("query_name\tquery_length\taccession_number\tsubject_length\tsubject_description\tE value"
+                            "\tbit score\tframe\tquery_start\tquery_end\thit_start\thit_end\t%_conserved\t%_identity\n")
+            self.nohits.write("query_name\n")
+            if self.listed is None:
+                self.header.write("query_name\tsubject_description\n")
+            else:
+                self.header.write("query_name\tsubject_id\n")
+                self.subjects.write("subject_id\taccession_number\tsubject_description\n")
+        elif self.fileformat == "tab":
+            self.hits.write("qseqid\tsseqid\tpident\tlength\tmismatch\tgapopen\tqstart\tqend\tsstart\tsend\tevalue\tbitscore\n")
+            self.nohits.write("qseqid\n")
+            self.header.write("qseqid\tsseqid\n")
+
+    def write_query(self, cur_query):
+        # If this query had hits write top hits to result files. They are formatted WRITE_HITS at a time, so the hits
+        # of a query with very many hits (a HitRuns) are written as they are read.
+        if len(cur_query.hits) != 0:
+            hits = iter(cur_query.hits)
+            while True:
+                batch = list(islice(hits, self.WRITE_HITS))
+                if len(batch) == 0:
+                    break
+                rows, header, subjects = self.format_xml(cur_query, batch)
+                self.hits.write(''.join(rows))
+                self.header.write(''.join(header))
+                self.subjects.write(''.join(subjects))
+                self.rows[0] += len(rows)
+        else:
+            self.nohits.write("{}\tNo hits found.\n".format(cur_query.def_))
+            self.rows[1] += 1
+        if self.autoflush:
+            self.flush()
+
+    def write_block(self, block):
+        # Tabular results are written a whole chunk at a time, already formatted (see TabBlock)
+        self.hits.write(block.hits)
+        self.header.write(block.header)
+        self.nohits.write(block.nohits)
+        if self.listed is not None:
+            self.subjects.write(''.join(['{}\t{}\t{}\n'.format(*subject) for subject in block.subjects
+                                         if self.listed_new(subject[0])]))
+        self.rows[0] += block.hits.count('\n')
+        self.rows[1] += block.nohits.count('\n')
+        if self.autoflush:
+            self.flush()
+
+    def format_xml(self, cur_query, hits):
+        # The hit rows and header rows of some hits of a query, and the rows of the subjects file of the subjects
+        # not listed yet
+        rows = []
+        header = []
+        subjects = []
+        for hit in hits:
+            rows.append(self.XML_ROW.format(cur_query.def_, cur_query.length,
+                            hit.accession, hit.length, hit.def_,
+                            hit.evalue, hit.bitscore, hit.query_frame,
+                            hit.query_start, hit.query_end, hit.hit_start,
+                            hit.hit_end, hit.p_conserved, hit.p_identity))
+            if self.listed is None:
+                header.append('{}\t{}\n'.format(cur_query.def_, hit.def_))
+                continue
+            id = hit.subject.file_id
+            if id is None:
+                id = hit.subject.file_id = subject_id(hit.accession, hit.def_)
+            header.append('{}\t{}\n'.format(cur_query.def_, id))
+            if self.listed_new(id):
+                subjects.append('{}\t{}\t{}\n'.format(id, hit.accession, hit.def_))
+        return rows, header, subjects
+
+    def listed_new(self, id):
+        # Lists a subject, returns False if it was listed already
+        if id in self.listed:
+            return False
+        self.listed.add(id)
+        return True
+
+    def flush(self):
+        self.hits.flush()
+        self.nohits.flush()
+        self.header.flush()
+        self.subjects.flush()
+
+    def sync(self):
+        # Writes the result files to disk and returns their sizes by path
+        sinks = (self.hits, self.nohits, self.header) + ((self.subjects,) if self.listed is not None else ())
+        return {sink.path: sink.sync() for sink in sinks}
+
+    def close(self):
+        self.hits.close()
+        self.nohits.close()
+        self.header.close()
+        self.subjects.close()
+
+
+def result_suffixes(options):
+    # File name suffixes of the result files: the three text files and the subjects file of '--subjectfile' (with
+    # the extension of the output compression), the two Parquet files or the SQLite database (see '--outformat')
+    return format_suffixes(options.outformat, options.outcompress, options.subjectfile)
+
+
+def format_suffixes(outformat, outcompress, subjectfile):
+    if outformat == 'parquet':
+        return ('.hits.parquet', '.nohits.parquet')
+    if outformat == 'sqlite':
+        return ('.sqlite',)
+    extension = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[outcompress]
+    suffixes = ('.hits.txt', '.nohits.txt', '.hits.header') + (('.subjects',) if subjectfile else ())
+    return tuple(suffix + extension for suffix in suffixes)
+
+
+def open_result(path, compress, mode):
+    # Opens a text result file written with '--outcompress' 'compress'
+    if compress == 'gzip':
+        return gzip.open(path, mode)
+    if compress == 'zstd':
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def subject_id(accession, def_):
+    # The id of a subject in the subjects file of '--subjectfile': a hash of its accession and description, so that
+    # the subjects files of shards and of different result files can be merged without renumbering
+    return hashlib.blake2b('{}\t{}'.format(accession, def_).encode(), digest_size=8).hexdigest()
+
+
+def read_subjects(path, compress):
+    # The ids of the subjects listed in a subjects file
+    with open_result(path, compress, 'rb') as subjects:
+        subjects.readline()
+        return [line.split(b'\t', 1)[0].decode() for line in subjects]
+
+
+def open_writer(options, sizes=None):
+    # The result writer for '--outformat'
+    if options.outformat == 'parquet':
+        return ParquetResultWriter(options)
+    if options.outformat == 'sqlite':
+        return SQLiteResultWriter(options)
+    return ResultWriter(options, sizes)
+
+
+class TableWriter:
+    # Base of the result writers that store typed rows instead of text ('--outformat parquet' or 'sqlite'), so the
+    # results can be loaded without parsing text. The hits table has one typed column per column of {}.hits.txt
+    # ('%_conserved' and '%_identity' as plain numbers), the nohits table the names of the queries without hits; the
+    # {}.hits.header columns are in the hits table already. Rows are gathered and handed to 'write_rows' every
+    # BATCH_ROWS rows. XML queries are stored from their values, blocks of text rows (tabular results and results
+    # read from the parse cache) are split into typed values.
+    XML_COLUMNS = (('query_name', str), ('query_length', int), ('accession_number', str), ('subject_length', int),
+                   ('subject_description', str), ('evalue', float), ('bitscore', float), ('frame', int),
+                   ('query_start', int), ('query_end', int), ('hit_start', int), ('hit_end', int),
+                   ('p_conserved', float), ('p_identity', float))
+    # Tabular results: the 12 standard columns, salltitles (the 13th column) and any further columns as tab
+    # separated text
+    TAB_COLUMNS = (('qseqid', str), ('sseqid', str), ('pident', float), ('length', int), ('mismatch', int),
+                   ('gapopen', int), ('qstart', int), ('qend', int), ('sstart', int), ('send', int),
+                   ('evalue', float), ('bitscore', float), ('salltitles', str), ('extra', str))
+    BATCH_ROWS = 1 << 16
+
+    def __init__(self, options):
+        self.fileformat = options.fileformat
+        self.name = options.output
+        self.autoflush = options.flush
+        self.rows = [0, 0]      # Hit rows and no hit rows written, for the '--stats' report
+        self.columns = self.XML_COLUMNS if self.fileformat == "XML" else self.TAB_COLUMNS
+        self.nohits_column = self.columns[0]
+        self.hits = []          # Rows not written yet
+        self.nohits = []
+
+    def write_query(self, cur_query):
+        if len(cur_query.hits) != 0:
+            # The rows of a query with very many hits (a HitRuns) are written as they are read
+            length = int(cur_query.length)
+            hits = iter(cur_query.hits)
+            while True:
+                batch = list(islice(hits, self.BATCH_ROWS))
+                if len(batch) == 0:
+                    break
+                self.hits.extend((cur_query.def_, length, hit.accession, int(hit.length), hit.def_, hit.evalue,
+                                  hit.bitscore, hit.query_frame, hit.query_start, hit.query_end, hit.hit_start,
+                                  hit.hit_end, hit.p_conserved, hit.p_identity) for hit in batch)
+                self.rows[0] += len(batch)
+                if self.pending() >= self.BATCH_ROWS:
+                    self.write_rows()
+        else:
+            self.nohits.append((cur_query.def_,))
+            self.rows[1] += 1
+        self.written()
+
+    def write_block(self, block):
+        # A block of text rows as written to the text files (see TabBlock)
+        self.add_hit_lines(block.hits)
+        lines = block.nohits.splitlines()
+        self.nohits.extend((line.rsplit('\t', 1)[0],) for line in lines)
+        self.rows[1] += len(lines)
+        self.written()
+
+    def add_hit_lines(self, text):
+        lines = text.splitlines()
+        self.hits.extend(self.typed_rows(lines))
+        self.rows[0] += len(lines)
+
+    def typed_rows(self, lines):
+        # The typed rows of text rows. The values are converted a column at a time when all the rows have the same
+        # number of columns, which is the usual case.
+        rows = [line.split('\t') for line in lines]
+        if len(set(map(len, rows))) != 1:
+            return [self.typed_row(row) for row in rows]
+        columns = list(zip(*rows))
+        if self.fileformat == "XML":
+            columns[12:] = [[value[:-1] for value in column] for column in columns[12:]]
+        else:
+            columns[13:] = [list(map('\t'.join, zip(*columns[13:])))] if len(columns) > 13 else [[None] * len(rows)]
+            if len(columns) == 13:
+                columns.insert(12, [None] * len(rows))
+        return zip(*[column if kind is str else map(kind, column)
+                     for (name, kind), column in zip(self.columns, columns)])
+
+    def typed_row(self, values):
+        if self.fileformat == "XML":
+            values[12] = values[12].rstrip('%')
+            values[13] = values[13].rstrip('%')
+        else:
+            values[13:] = ['\t'.join(values[13:]) if len(values) > 13 else None]
+            if len(values) == 13:
+                values.insert(12, None)
+        return tuple(value if value is None or kind is str else kind(value)
+                     for (name, kind), value in zip(self.columns, values))
+
+    def pending(self):
+        return len(self.hits) + len(self.nohits)
+
+    def written(self):
+        if self.pending() >= self.BATCH_ROWS:
+            self.write_rows()
+        if self.autoflush:
+            self.flush()
+
+    def flush(self):
+        self.write_rows()
+
+
+class ParquetResultWriter(TableWriter):
+    # Writes the hits and nohits tables to {}.hits.parquet and {}.nohits.parquet (requires the 'pyarrow' module),
+    # a row group every BATCH_ROWS rows. The files are compressed with '--outcompress' (snappy by default). Rows are
+    # in input order, so the row group statistics of the query name narrow down lookups by query. Blocks of text rows
+    # are split and converted by the CSV reader of pyarrow, which is much faster than doing it row by row.
+    def __init__(self, options):
+        TableWriter.__init__(self, options)
+        load_optional('pyarrow', 'pa')
+        load_optional('pyarrow.parquet', 'pq')
+        import pyarrow.csv
+        import pyarrow.compute
+        types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+        self.schemas = [pa.schema([(name, types[kind]) for name, kind in columns])
+                        for columns in (self.columns, (self.nohits_column,))]
+        self.files = [pq.ParquetWriter(options.output + suffix, schema, compression=options.outcompress or 'snappy')
+                      for suffix, schema in zip(result_suffixes(options), self.schemas)]
+        self.tables = []        # Hit rows already converted to tables, followed by those in 'hits'
+        self.table_rows = 0
+
+    def add_hit_lines(self, text):
+        table = self.read_lines(text) if len(text) != 0 else None
+        if table is None:
+            TableWriter.add_hit_lines(self, text)
+            return
+        self.convert_rows()
+        self.tables.append(table)
+        self.table_rows += table.num_rows
+        self.rows[0] += table.num_rows
+
+    def read_lines(self, text):
+        # The table of text rows, or None if the rows have a varying number of columns or values the CSV reader does
+        # not convert like Python does (the rows are then converted by TableWriter)
+        width = text.count('\t', 0, text.find('\n')) + 1
+        if width < 12 or (self.fileformat == "XML" and width != 14):
+            return None
+        names = [str(i) for i in range(width)]
+        types = {names[i]: field.type for i, field in enumerate(self.schemas[0]) if i < 12}
+        try:
+            table = pa.csv.read_csv(
+                pa.py_buffer(text.encode()), read_options=pa.csv.ReadOptions(column_names=names),
+                parse_options=pa.csv.ParseOptions(delimiter='\t', quote_char=False),
+                convert_options=pa.csv.ConvertOptions(column_types=dict(types, **{name: pa.string() for name in names[12:]}),
+                                                      null_values=[], strings_can_be_null=False))
+        except pa.ArrowInvalid:
+            return None
+        columns = table.columns[:12]
+        if self.fileformat == "XML":
+            columns += [pa.compute.cast(pa.compute.utf8_rtrim(column, characters='%'), pa.float64())
+                        for column in table.columns[12:]]
+        else:
+            nulls = pa.nulls(table.num_rows, pa.string())
+            columns.append(table.column(12) if width > 12 else nulls)
+            columns.append(pa.compute.binary_join_element_wise(*table.columns[13:], '\t') if width > 13 else nulls)
+        return pa.Table.from_arrays(columns, schema=self.schemas[0])
+
+    def convert_rows(self):
+        # Moves the hit rows in 'hits' to 'tables'
+        if len(self.hits) != 0:
+            schema = self.schemas[0]
+            self.tables.append(pa.Table.from_arrays(
+                [pa.array(values, field.type) for values, field in zip(zip(*self.hits), schema)], schema=schema))
+            self.table_rows += len(self.hits)
+            self.hits.clear()
+
+    def pending(self):
+        return self.table_rows + len(self.hits) + len(self.nohits)
+
+    def write_rows(self):
+        self.convert_rows()
+        if len(self.tables) != 0:
+            self.files[0].write_table(pa.concat_tables(self.tables))
+            self.tables = []
+            self.table_rows = 0
+        if len(self.nohits) != 0:
+            schema = self.schemas[1]
+            self.files[1].write_table(pa.Table.from_arrays([pa.array([row[0] for row in self.nohits], pa.string())],
+                                                           schema=schema))
+            self.nohits.clear()
+
+    def flush(self):
+        # A Parquet file cannot be read before it is closed, so rows are only written in full row groups
+        pass
+
+    def close(self):
+        self.write_rows()
+        for parquet_file in self.files:
+            parquet_file.close()
+
+
+class SQLiteResultWriter(TableWriter):
+    # Writes the hits and nohits tables to the SQLite database {}.sqlite, BATCH_ROWS rows per transaction. The
+    # database is written without a journal, as it is written again if the run fails. Indexes on the query name and
+    # the accession (sseqid for tabular results) are built once all the rows are in.
+    SQL_TYPES = {str: 'TEXT', int: 'INTEGER', float: 'REAL'}
+
+    def __init__(self, options):
+        import sqlite3
+        TableWriter.__init__(self, options)
+        self.path = options.output + '.sqlite'
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE hits ({})'.format(', '.join(
+            '{} {}'.format(name, self.SQL_TYPES[kind]) for name, kind in self.columns)))
+        self.db.execute('CREATE TABLE nohits ({} TEXT)'.format(self.nohits_column[0]))
+        self.insert_hits = 'INSERT INTO hits VALUES ({})'.format(', '.join('?' * len(self.columns)))
+
+    def write_rows(self):
+        with self.db:
+            self.db.executemany(self.insert_hits, self.hits)
+            self.db.executemany('INSERT INTO nohits VALUES (?)', self.nohits)
+        self.hits.clear()
+        self.nohits.clear()
+
+    def close(self):
+        self.write_rows()
+        accession = self.columns[2 if self.fileformat == "XML" else 1][0]
+        with self.db:
+            self.db.execute('CREATE INDEX hits_query ON hits ({})'.format(self.columns[0][0]))
+            self.db.execute('CREATE INDEX hits_accession ON hits ({})'.format(accession))
+        self.db.close()
+
+
+class ResultAppender:
+    # Appends result files of one kind, in order, to a single result file, to merge the results of shards and files
+    # ('--merge', '--files'). Text results keep the column header line of the first file only; compressed text is
+    # decompressed and compressed again. Subjects files keep the first row of each subject only. Parquet files are
+    # copied a row group at a time and SQLite databases a table at a time (the first one is copied whole).
+    def __init__(self, path, options):
+        self.path = path
+        self.options = options
+        self.file = None
+        if not path.endswith(('.parquet', '.sqlite')):
+            self.file = self.open(path, 'wb')
+        self.header = True
+        self.listed = set() if '.subjects' in os.path.basename(path) else None
+
+    def open(self, path, mode):
+        return open_result(path, self.options.outcompress, mode)
+
+    def append(self, path):
+        if self.path.endswith('.parquet'):
+            load_optional('pyarrow', 'pa')
+            load_optional('pyarrow.parquet', 'pq')
+            part = pq.ParquetFile(path)
+            if self.file is None:
+                self.file = pq.ParquetWriter(self.path, part.schema_arrow,
+                                             compression=self.options.outcompress or 'snappy')
+            for i in range(part.num_row_groups):
+                self.file.write_table(part.read_row_group(i))
+            part.close()
+        elif self.path.endswith('.sqlite'):
+            import sqlite3
+            if self.file is None:
+                shutil.copyfile(path, self.path)
+                self.file = sqlite3.connect(self.path)
+                self.file.execute('PRAGMA journal_mode = OFF')
+                return
+            self.file.execute('ATTACH DATABASE ? AS part', (path,))
+            with self.file:
+                for table in ('hits', 'nohits'):
+                    self.file.execute('INSERT INTO main.{0} SELECT * FROM part.{0}'.format(table))
+            self.file.execute('DETACH DATABASE part')
+        elif self.listed is not None:
+            with self.open(path, 'rb') as part:
+                header = part.readline()
+                if self.header:
+                    self.file.write(header)
+                for line in part:
+                    id = line.split(b'\t', 1)[0]
+                    if id not in self.listed:
+                        self.listed.add(id)
+                        self.file.write(line)
+        else:
+            with self.open(path, 'rb') as part:
+                if not self.header:
+                    part.readline()
+                shutil.copyfileobj(part, self.file, 1 << 20)
+        self.header = False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class TabBlock:
+    # The filtered and ranked results of a chunk of tabular input, formatted for the three result files. Hit rows
+    # are the input lines of the hits that were kept, in ranked order. Blocks of XML results read from a parse cache
+    # with '--subjectfile' also hold the (id, accession, description) of the subject of each hit row.
+    def __init__(self, hits, header, nohits, subjects=None):
+        self.hits = hits
+        self.header = header
+        self.nohits = nohits
+        self.subjects = subjects
+
+    def blocks(self):
+        # The block in the pieces it is written in, see TabRuns
+        return [self]
+
+
+def select_rows(options, group, ngroups, column, stats=None):
+    # Column-wise counterpart of 'apply_thresholds' and HitRanker for many queries at once. 'group' holds the query
+    # number of every row (in increasing order) and 'column(name)' returns the 'evalue', 'bitscore', 'p_identity'
+    # or 'deflevel' column; columns are only requested when a threshold or the ordering needs them. Returns the rows
+    # that were kept, in ranked order, and which of the queries have any hits left.
+    if stats is None:
+        stats = Stats()
+    keep = np.ones(len(group), bool)
+    # Apply thresholds as masks over all rows. A threshold below zero cannot exclude any hit.
+    masks = []
+    if options.evalue != float('Inf'):
+        masks.append(('dropped_evalue', column('evalue') <= options.evalue))
+    if options.bitscore >= 0:
+        masks.append(('dropped_bitscore', column('bitscore') >= options.bitscore))
+    if options.identity >= 0:
+        masks.append(('dropped_identity', column('p_identity') >= options.identity))
+    if options.definition >= 0:
+        masks.append(('dropped_deflevel', column('deflevel') >= options.definition))
+    for counter, mask in masks:
+        keep &= mask
+        if stats.enabled:
+            stats.count(counter, len(mask) - int(np.count_nonzero(mask)))
+    rows = np.flatnonzero(keep)
+    stats.count('queries', ngroups)
+    stats.count('hsps', len(group))
+    stats.count('hsps_kept', len(rows))
+
+    # Rank the rows of each query. lexsort is stable, so ties keep the input order like HitRanker does.
+    if options.order == 'e':
+        key = column('evalue')
+    elif options.order == 'b':
+        key = -column('bitscore')
+    elif options.order == 'i':
+        key = -column('p_identity')
+    else:
+        key = -column('deflevel')
+    rows = rows[np.lexsort((key[rows], group[rows]))]
+
+    range_ = {'e': options.erange, 'b': options.brange, 'i': options.irange}.get(options.order, 0)
+    if range_ != 0 and len(rows) != 0:
+        # Keep the hits within range of the best hit of each query, the most detailed definitions first
+        best = key[rows][run_starts(group[rows])]
+        rows = rows[key[rows] <= best + range_]
+        rows = rows[np.lexsort((rows, key[rows], -column('deflevel')[rows], group[rows]))]
+    if options.number != 0 and len(rows) != 0:
+        rank = np.arange(len(rows)) - run_starts(group[rows])
+        rows = rows[rank < options.number]
+
+    found = np.zeros(ngroups, bool)
+    found[group[rows]] = True
+    return rows, found
+
+
+def run_starts(group):
+    # For every element of a sorted group array, the position of the first element of its group
+    change = np.flatnonzero(group[1:] != group[:-1]) + 1
+    firsts = np.concatenate(([0], change))
+    return np.repeat(firsts, np.diff(np.concatenate((firsts, [len(group)]))))
+
+
+class TabularChunk:
+    # A chunk of tabular (outfmt 6) lines viewed column-wise with NumPy. Tabs and newlines are located in a single
+    # vectorized pass over the raw bytes, and a column is only converted to a typed array when a threshold or the
+    # ordering needs it. Rows are grouped by query with run boundaries of the qseqid column. Chunks whose lines do not
+    # all have the same number of columns are not 'regular' and are handled line by line instead. Chunks holding
+    # comment or blank lines are not regular either, see 'without_comments'.
+    def __init__(self, data, type_):
+        self.data = data
+        self.type = type_
+        self.buf = np.frombuffer(data, np.uint8)
+        self.ends = np.flatnonzero(self.buf == 10)
+        self.starts = np.empty(len(self.ends), np.int64)
+        self.starts[0:1] = 0
+        self.starts[1:] = self.ends[:-1] + 1
+        tabs = np.flatnonzero(self.buf == 9)
+        rows = len(self.ends)
+        self.comments = (self.ends == self.starts) | (self.buf[self.starts] == ord('#'))
+        self.ncols = len(tabs) // rows + 1 if rows != 0 else 0
+        self.regular = rows != 0 and self.ncols >= 12 and len(tabs) == rows * (self.ncols - 1) and not self.comments.any()
+        if self.regular:
+            # Every line holds exactly ncols - 1 tabs if the first and last tab of each row lie within that line
+            self.tabs = tabs.reshape(rows, self.ncols - 1)
+            self.regular = bool((self.tabs[:, 0] > self.starts).all() and (self.tabs[:, -1] < self.ends).all())
+        self.columns = {}
+        self.padded = None
+
+    def without_comments(self):
+        lines = np.flatnonzero(~self.comments)
+        return self.gather(self.starts[lines], self.ends[lines] + 1)[0].tobytes()
+
+    def field(self, j):
+        # The bytes of column j as a fixed width 'S' array
+        start = self.starts if j == 0 else self.tabs[:, j - 1] + 1
+        end = self.tabs[:, j] if j < self.ncols - 1 else self.ends
+        lengths = end - start
+        width = max(int(lengths.max()), 1)
+        if self.padded is None or len(self.padded) < len(self.data) + width:
+            self.padded = np.frombuffer(self.data + bytes(width), np.uint8)
+        window = np.lib.stride_tricks.as_strided(self.padded, shape=(len(self.data), width), strides=(1, 1))
+        values = window[start]
+        values[np.arange(width) >= lengths[:, None]] = 0
+        return values.view('S%d' % width).ravel()
+
+    def floats(self, j):
+        if j not in self.columns:
+            self.columns[j] = self.field(j).astype(np.float64)
+        return self.columns[j]
+
+    def deflevel(self, type_=None):
+        # Count the delimiters in the salltitles column (13th) of every line, as is done for <Hit_def>
+        if type_ is None:
+            type_ = self.type
+        if 'deflevel' + type_ not in self.columns:
+            if self.ncols < 13:
+                levels = np.zeros(len(self.ends))
+            else:
+                delimiter = ord(';') if type_ == 'n' else ord('>')
+                found = np.flatnonzero(self.buf == delimiter)
+                line = np.searchsorted(self.ends, found)
+                inside = found > self.tabs[line, 11]
+                if self.ncols > 13:
+                    inside &= found < self.tabs[line, 12]
+                levels = 1.0 + np.bincount(line[inside], minlength=len(self.ends))
+            self.columns['deflevel' + type_] = levels
+        return self.columns['deflevel' + type_]
+
+    def groups(self):
+        # Index of the first row of every query, and the query number of every row
+        if 'groups' not in self.columns:
+            qseqid = self.field(0)
+            firsts = np.flatnonzero(qseqid[1:] != qseqid[:-1]) + 1
+            group = np.zeros(len(self.ends), np.int64)
+            group[firsts] = 1
+            self.columns['groups'] = (np.concatenate(([0], firsts)), np.cumsum(group), qseqid)
+        return self.columns['groups']
+
+    def gather(self, start, end):
+        # Concatenates the byte ranges [start, end) of the chunk. Ranges of similar length are copied as the rows of
+        # a fixed width matrix, which is much faster than indexing every byte on its own.
+        lengths = end - start
+        offsets = np.cumsum(lengths) - lengths
+        total = int(lengths.sum())
+        width = int(lengths.max()) if len(lengths) != 0 else 0
+        if width * len(lengths) <= 2 * total:
+            if self.padded is None or len(self.padded) < len(self.data) + width:
+                self.padded = np.frombuffer(self.data + bytes(width), np.uint8)
+            window = np.lib.stride_tricks.as_strided(self.padded, shape=(len(self.data), width), strides=(1, 1))
+            values = window[start][np.arange(width) < lengths[:, None]]
+        else:
+            values = self.buf[np.arange(total) - np.repeat(offsets - start, lengths)]
+        return values, offsets + lengths
+
+    def column(self, name):
+        # The columns used by 'select_rows'
+        if name == 'deflevel':
+            return self.deflevel()
+        return self.floats({'p_identity': 2, 'evalue': 10, 'bitscore': 11}[name])
+
+    def select(self, options, stats=None):
+        firsts, group, qseqid = self.groups()
+        rows, found = select_rows(options, group, len(firsts), self.column, stats)
+        return rows, firsts[~found], qseqid
+
+    def cache_columns(self):
+        # Column values of the chunk for the parse cache, see CacheBuilder.tab_columns
+        firsts, group, qseqid = self.groups()
+        return {'query_rows': np.diff(np.append(firsts, len(self.ends))),
+                'qseqid': [name.decode() for name in qseqid[firsts].tolist()],
+                'evalue': self.floats(10), 'bitscore': self.floats(11), 'p_identity': self.floats(2),
+                'deflevel_n': self.deflevel('n'), 'deflevel_p': self.deflevel('p'),
+                'line': (self.data, self.ends + 1 - self.starts)}
+
+    def block(self, options, stats=None):
+        if stats is None:
+            stats = Stats()
+        with stats.stage('filter'):
+            rows, nohits, qseqid = self.select(options, stats)
+        with stats.stage('format'):
+            return self.format_block(rows, nohits, qseqid)
+
+    def format_block(self, rows, nohits, qseqid):
+        if len(rows) == len(self.ends) and (rows == np.arange(len(rows))).all():
+            hits = self.data
+        else:
+            hits = self.gather(self.starts[rows], self.ends[rows] + 1)[0].tobytes()
+        header, ends = self.gather(self.starts[rows], self.tabs[rows, 1] + 1)
+        header[ends - 1] = 10
+        nohits = b''.join([name + b'\tNo hits found.\n' for name in qseqid[nohits]])
+        return TabBlock(hits.decode(), header.tobytes().decode(), nohits.decode())
+
+
+class HitRuns:
+    # The hits of a query with more hits than '--spilllimit', gathered without holding them all in memory. Hits are
+    # kept 'limit' at a time; each full batch is written to a temporary file as a run, sorted first when there is a
+    # 'key' (by key and then by the order the hits were added, like a stable sort). Reading merges the sorted runs
+    # (k-way, with heapq.merge) so the hits come back in order, or reads the runs one after another without a key.
+    # A HitRuns has a length and can be read any number of times; its files are removed with it. When it is pickled
+    # (the results of a worker process, see 'run_parallel') the files are handed over rather than copied, and the
+    # copy that is received reads and removes them. Merging reads a record of every run at a time, so records are
+    # kept small enough for all of them to hold about 'limit' hits.
+    RECORD = 4096       # Hits per pickled record at most. The hits of a record share their subjects.
+    FAN_IN = 64         # Runs are merged into one once there are this many, to bound the files open when reading
+
+    def __init__(self, limit, key=None):
+        self.limit = limit
+        self.record = max(1, min(self.RECORD, limit // self.FAN_IN)) if limit != 0 else self.RECORD
+        self.key = key
+        self.sorted = key is not None
+        self.paths = []
+        self.buffer = []        # Hits not written yet, as (key, n, hit) when sorted
+        self.count = 0
+
+    def add(self, hit):
+        if self.sorted:
+            self.buffer.append((self.key(hit), self.count, hit))
+        else:
+            self.buffer.append(hit)
+        self.count += 1
+        if self.limit != 0 and len(self.buffer) >= self.limit:
+            self.spill()
+
+    def extend(self, hits):
+        # Adds the hits up to the next spill at a time
+        hits = iter(hits)
+        while True:
+            batch = list(islice(hits, self.limit - len(self.buffer) if self.limit != 0 else None))
+            if len(batch) == 0:
+                return
+            if self.sorted:
+                key = self.key
+                numbers = range(self.count, self.count + len(batch))
+                self.buffer.extend([(key(hit), n, hit) for n, hit in zip(numbers, batch)])
+            else:
+                self.buffer.extend(batch)
+            self.count += len(batch)
+            if self.limit != 0 and len(self.buffer) >= self.limit:
+                self.spill()
+
+    def spill(self):
+        if self.sorted:
+            self.buffer.sort()
+        self.paths.append(self.write_run(self.buffer))
+        self.buffer = []
+        if len(self.paths) >= self.FAN_IN:
+            merged = self.write_run(self.entries())
+            self.close()
+            self.paths = [merged]
+
+    def write_run(self, entries):
+        import pickle
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix='blastqc-', suffix='.run')
+        try:
+            with os.fdopen(fd, 'wb') as run:
+                entries = iter(entries)
+                while True:
+                    record = list(islice(entries, self.record))
+                    if len(record) == 0:
+                        return path
+                    pickle.dump(record, run, pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            os.remove(path)
+            raise
+
+    @staticmethod
+    def read_run(path):
+        import pickle
+        with open(path, 'rb') as run:
+            while True:
+                try:
+                    record = pickle.load(run)
+                except EOFError:
+                    return
+                yield from record
+
+    def entries(self):
+        runs = [self.read_run(path) for path in self.paths]
+        if not self.sorted:
+            return chain(*runs, self.buffer)
+        self.buffer.sort()
+        return heapq.merge(*runs, self.buffer)
+
+    def __iter__(self):
+        if not self.sorted:
+            return self.entries()
+        return (hit for key, n, hit in self.entries())
+
+    def __len__(self):
+        return self.count
+
+    def contents(self):
+        # The hits as a list if none had to be written out, otherwise the HitRuns itself
+        if len(self.paths) != 0:
+            return self
+        return [entry[2] for entry in sorted(self.buffer)] if self.sorted else self.buffer
+
+    def __getstate__(self):
+        state = dict(self.__dict__, key=None)
+        self.paths = []
+        return state
+
+    def close(self):
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.paths = []
+
+    def __del__(self):
+        self.close()
+
+
+class HitRanker:
+    # Ranks all the hits of one query that passed the thresholds, in a single batch. Hits are ranked by a single key
+    # (smaller is better) with ties kept in input order, exactly like a stable sort. With '-n' set only the N best
+    # hits are selected (O(n log N)). With a range (-er/-br/-ir) every hit within range of the best hit is kept and
+    # those are re-ranked by the level of definition. Queries with more hits than '--spilllimit' to order are ranked
+    # in bounded memory (see 'rank_runs').
+    def __init__(self, options):
+        self.number = options.number
+        self.range = {'e': options.erange, 'b': options.brange, 'i': options.irange}.get(options.order, 0)
+        self.limit = options.spilllimit
+        self.deflevel = lambda hit: hit.deflevel
+        if options.order == 'e':
+            self.key = lambda hit: hit.evalue
+        elif options.order == 'b':
+            self.key = lambda hit: -hit.bitscore
+        elif options.order == 'i':
+            self.key = lambda hit: -hit.p_identity
+        elif options.order == 'd':
+            self.key = lambda hit: -hit.deflevel
+
+    def rank(self, hits):
+        # 'hits' is a list, or any iterable of hits for a query with too many hits to hold (see HitRuns)
+        if self.range == 0 and self.number != 0:
+            # 'nsmallest' is stable, equivalent to sorted(hits, key=key)[:number], and only holds N hits
+            return heapq.nsmallest(self.number, hits, key=self.key)
+        if not isinstance(hits, list):
+            if self.limit != 0:
+                return self.rank_runs(hits)
+            hits = list(hits)
+        elif self.limit != 0 and len(hits) > self.limit:
+            return self.rank_runs(hits)
+        if len(hits) == 0:
+            return hits
+        if self.range != 0:
+            # Only hits within range of the best hit, the most detailed definitions first
+            keys = [self.key(hit) for hit in hits]
+            accept_val = min(keys) + self.range
+            candidates = [i for i in range(len(hits)) if keys[i] <= accept_val]
+            deflevel = self.deflevel
+            candidates.sort(key=lambda i: (-deflevel(hits[i]), keys[i], i))
+            ranked = [hits[i] for i in candidates]
+        else:
+            # Everything is returned, so a plain (stable) sort is cheapest
+            return sorted(hits, key=self.key)
+
+        # Apply the input filter number unless all matching hits are desired
+        if self.number != 0:
+            ranked = ranked[0:self.number]
+        return ranked
+
+    def rank_runs(self, hits):
+        # Memory-bounded counterpart of 'rank' for the orders that need every hit: the hits are sorted by key in runs
+        # of '--spilllimit' hits that spill to temporary files and are merged as they are read (see HitRuns). The
+        # result is a HitRuns too, read in streaming fashion by the result writer, or a list if everything fit.
+        ordered = HitRuns(self.limit, self.key)
+        ordered.extend(hits)
+        if self.range == 0:
+            return ordered.contents()
+
+        # The hits within range of the best hit are the first ones in order. Among hits with the same key the
+        # merge keeps input order, so re-ranking them by definition breaks ties like 'rank' does.
+        key = self.key
+        deflevel = self.deflevel
+        candidates = iter(ordered)
+        best = next(candidates, None)
+        if best is None:
+            return []
+        accept_val = key(best) + self.range
+        candidates = takewhile(lambda hit: key(hit) <= accept_val, chain([best], candidates))
+        definition = lambda hit: (-deflevel(hit), key(hit))
+        if self.number != 0:
+            return heapq.nsmallest(self.number, candidates, key=definition)
+        ranked = HitRuns(self.limit, definition)
+        ranked.extend(candidates)
+        return ranked.contents()
+
+
+class TabRowRanker(HitRanker):
+    # HitRanker for the rows of a TabQuery, ranked as (evalue, bitscore, p_identity, deflevel, line) tuples
+    def __init__(self, options):
+        HitRanker.__init__(self, options)
+        self.deflevel = lambda row: row[3]
+        if options.order == 'e':
+            self.key = lambda row: row[0]
+        elif options.order == 'b':
+            self.key = lambda row: -row[1]
+        elif options.order == 'i':
+            self.key = lambda row: -row[2]
+        elif options.order == 'd':
+            self.key = lambda row: -row[3]
+
+
+class TabQuery:
+    # A query of tabular input with more rows than '--spilllimit'. Its rows are not carried from chunk to chunk as
+    # lines but kept in a HitRuns as they are read (see 'iterate_tab'), and it is filtered and ranked on its own.
+    # The rows are ranked as tuples rather than Hits (see TabRowRanker), which are much cheaper to write to runs and
+    # read back. 'declared' is the number of rows given by the comment line before it in live mode, or None.
+    BATCH_ROWS = 4096
+
+    def __init__(self, qseqid, limit, declared=None):
+        self.qseqid = qseqid
+        self.prefix = (qseqid + '\t').encode()
+        self.rows = HitRuns(limit)      # Lines without their line end
+        self.declared = declared
+
+    def __len__(self):
+        return len(self.rows)
+
+    def whole(self):
+        return self.declared is not None and len(self.rows) >= self.declared
+
+    def batches(self):
+        # The rows as chunks of BATCH_ROWS tabular lines
+        rows = iter(self.rows)
+        while True:
+            batch = list(islice(rows, self.BATCH_ROWS))
+            if len(batch) == 0:
+                return
+            batch.append(b'')
+            yield b'\n'.join(batch)
+
+
+class TabRuns:
+    # The results of a TabQuery: its ranked rows, a HitRuns or a list (see TabRowRanker). They are formatted into
+    # TabBlocks WRITE_HITS rows at a time as they are read, so they are written without holding them all.
+    WRITE_HITS = 1 << 16
+
+    def __init__(self, qseqid, rows):
+        self.qseqid = qseqid
+        self.rows = rows
+
+    def blocks(self):
+        if len(self.rows) == 0:
+            yield TabBlock('', '', '{}\tNo hits found.\n'.format(self.qseqid))
+            return
+        rows = iter(self.rows)
+        while True:
+            batch = [row[4] for row in islice(rows, self.WRITE_HITS)]
+            if len(batch) == 0:
+                return
+            yield TabBlock(''.join([line + '\n' for line in batch]),
+                           ''.join(['{}\t{}\n'.format(self.qseqid, line.split('\t', 2)[1]) for line in batch]), '')
+
+
+class IterationSplitter:
+    # Finds complete <Iteration> ... </Iteration> elements in a stream of raw bytes without parsing the XML, so
+    # individual queries can be handed to a worker process and parsed there on their own. Data is passed in with
+    # 'feed' as it is read; only the unfinished query at the end of the stream is kept in the buffer.
+    START = b'<Iteration>'
+    END = b'</Iteration>'
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = -1         # Position of the unfinished <Iteration> in the buffer
+        self.scan = 0           # Position in the buffer from which the next search continues
+        self.dropped = 0        # Number of bytes of the stream dropped from the front of the buffer
+        self.ends = []          # Stream offsets just past each of the elements returned by the last 'feed'
+
+    def feed(self, data):
+        self.buffer += data
+        found = []
+        self.ends = []
+        while True:
+            if self.start < 0:
+                start = self.buffer.find(self.START, self.scan)
+                if start < 0:
+                    # Keep the last few bytes in case the tag is split between two reads
+                    self.scan = max(self.scan, len(self.buffer) - len(self.START) + 1)
+                    break
+                self.start = start
+                self.scan = start + len(self.START)
+            end = self.buffer.find(self.END, self.scan)
+            if end < 0:
+                self.scan = max(self.scan, len(self.buffer) - len(self.END) + 1)
+                break
+            end += len(self.END)
+            found.append(bytes(self.buffer[self.start:end]))
+            self.ends.append(self.dropped + end)
+            self.start = -1
+            self.scan = end
+
+        # Drop everything that has already been handed out or searched
+        cut = self.start if self.start >= 0 else self.scan
+        if cut > 0:
+            del self.buffer[:cut]
+            self.dropped += cut
+            self.scan -= cut
+            if self.start >= 0:
+                self.start -= cut
+        return found
+
+    def close(self):
+        if self.start >= 0:
+            raise ET.ParseError('no element found: unclosed <Iteration> at end of file')
+
+
+class ShardIndex:
+    # Sparse index of query start offsets in a results file, used to split the file into shards that can be
+    # processed on their own (see '--shard'). The file is memory mapped and, about every 'step' bytes, the next query
+    # boundary is searched for: the next <Iteration> tag in XML, or the next change of qseqid in tabular results. Only
+    # the pages around those points are read, so building the index is much cheaper than reading the file. The index
+    # is saved next to the input as {}.bqcidx and reused for as long as the size and modification time of the input
+    # (and the step) are unchanged.
+    SUFFIX = '.bqcidx'
+
+    def __init__(self, fileformat, size, mtime, step, offsets):
+        self.fileformat = fileformat
+        self.size = size
+        self.mtime = mtime
+        self.step = step
+        self.offsets = offsets      # Query start offsets in increasing order
+
+    @classmethod
+    def load_or_build(cls, path, fileformat, step):
+        stat = os.stat(path)
+        try:
+            with open(path + cls.SUFFIX) as index_file:
+                saved = json.load(index_file)
+            index = cls(saved['format'], saved['size'], saved['mtime'], saved['step'], saved['offsets'])
+            if (index.fileformat, index.size, index.mtime, index.step) == (fileformat, stat.st_size, stat.st_mtime_ns, step):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls.build(path, fileformat, step)
+        try:
+            with open(path + cls.SUFFIX, 'w') as index_file:
+                json.dump({'format': index.fileformat, 'size': index.size, 'mtime': index.mtime, 'step': index.step,
+                           'offsets': index.offsets}, index_file)
+        except OSError:
+            pass        # The index is only a cache; it is rebuilt next time if it cannot be saved
+        return index
+
+    @classmethod
+    def build(cls, path, fileformat, step):
+        with open(path, 'rb') as results_in:
+            stat = os.fstat(results_in.fileno())
+            offsets = []
+            if stat.st_size > 0:
+                with mmap.mmap(results_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    find = cls.next_iteration if fileformat == "XML" else cls.next_tab_query
+                    position = 0
+                    while position < stat.st_size:
+                        start = find(data, position)
+                        if start < 0:
+                            break
+                        offsets.append(start)
+                        position = start + max(step, 1)
+        return cls(fileformat, stat.st_size, stat.st_mtime_ns, step, offsets)
+
+    @staticmethod
+    def next_iteration(data, position):
+        return data.find(IterationSplitter.START, position)
+
+    @staticmethod
+    def next_tab_query(data, position):
+        # First line at or after 'position' whose qseqid differs from the line before it
+        if position == 0:
+            return 0
+        start = data.find(b'\n', position - 1) + 1
+        if start == 0:
+            return -1
+        previous = data.rfind(b'\n', 0, start - 1) + 1
+        tab = data.find(b'\t', previous, start)
+        qseqid = data[previous:tab if tab >= 0 else start - 1] + b'\t'
+        size = len(data)
+        while start < size and data[start:start + len(qseqid)] == qseqid:
+            start = data.find(b'\n', start) + 1
+            if start == 0:
+                return -1
+        return start if start < size else -1
+
+    def shard_range(self, k, n):
+        # Byte range [start, end) of shard 'k' (1-based) out of 'n'. Shards start on indexed query boundaries
+        # close to equal fractions of the file; a shard may be empty if the file has fewer boundaries than shards.
+        if len(self.offsets) == 0:
+            return self.size, self.size
+        first = self.offsets[0]
+
+        def boundary(i):
+            if i == n:
+                return self.size
+            target = first + (self.size - first) * i // n
+            j = bisect.bisect_left(self.offsets, target)
+            return self.offsets[j] if j < len(self.offsets) else self.size
+
+        return boundary(k - 1), boundary(k)
+
+
+class RangeReader:
+    # File-like wrapper that reads at most 'length' bytes from the current position of 'source'. Used to process
+    # a single shard of a results file with the usual streaming readers.
+    def __init__(self, source, length):
+        self.source = source
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class DecompressionError(OSError):
+    # Compressed input that is truncated or corrupt
+    pass
+
+
+class DecompressorUnavailable(RuntimeError):
+    # Compressed input that cannot be read here, as neither the module nor the command to decompress it is available
+    pass
+
+
+class DecompressedReader:
+    # File-like reader of gzip (or bgzip) or zstd compressed results, so compressed files (or a compressed stream on
+    # stdin) can be read without decompressing them to disk first. A background thread reads and decompresses the
+    # input (zlib and zstandard release the GIL) while the results are parsed, and keeps up to QUEUE blocks of
+    # decompressed data ready. Without the 'zstandard' module zstd input is decompressed by a 'zstd' process.
+    BLOCK = 64 << 10
+    QUEUE = 8
+    MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+    EXTENSIONS = {'.gz': 'gzip', '.bgz': 'gzip', '.zst': 'zstd'}
+
+    def __init__(self, source, kind, live=False):
+        self.source = source
+        self.live = live
+        self.buffer = bytearray()
+        self.done = False
+        self.process = None
+        self.blocks = queue.Queue(self.QUEUE)
+        if kind == 'zstd' and not load_optional('zstandard'):
+            import subprocess
+            self.process = subprocess.Popen(['zstd', '-dcq'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            threading.Thread(target=self.feed, daemon=True).start()
+        threading.Thread(target=self.decompress, args=(kind,), daemon=True).start()
+
+    @classmethod
+    def compression(cls, head, path=None):
+        # 'gzip' or 'zstd' from the first bytes of the input or else the file extension, None if not compressed
+        for magic, kind in cls.MAGIC.items():
+            if head.startswith(magic):
+                return kind
+        if path is not None and len(head) < 4:
+            return cls.EXTENSIONS.get(os.path.splitext(path)[1])
+        return None
+
+    @classmethod
+    def file_compression(cls, path):
+        try:
+            with open(path, 'rb') as results_in:
+                return cls.compression(results_in.read(4), path)
+        except OSError:
+            return None
+
+    def read_source(self, source):
+        # In live mode reads return whatever is available, see BLASTQC.reader
+        return source.read1 if self.live else source.read
+
+    def feed(self):
+        # Copies the compressed input to the 'zstd' process
+        read = self.read_source(self.source)
+        try:
+            while True:
+                data = read(self.BLOCK)
+                if not data:
+                    break
+                self.process.stdin.write(data)
+                if self.live:
+                    self.process.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def decompress(self, kind):
+        # Runs in the background thread and queues blocks of decompressed data, then None at the end (or the error)
+        try:
+            if self.process is not None:
+                read = self.read_source(self.process.stdout)
+                while True:
+                    block = read(self.BLOCK)
+                    if not block:
+                        break
+                    self.blocks.put(block)
+                if self.process.wait() != 0:
+                    raise DecompressionError('zstd could not decompress the input')
+            else:
+                self.inflate(kind)
+            self.blocks.put(None)
+        except BaseException as error:
+            self.blocks.put(error)
+
+    def inflate(self, kind):
+        # Decompresses gzip of any number of members (like bgzip) or zstd of any number of frames
+        if kind == 'gzip':
+            new_decompressor = lambda: zlib.decompressobj(31)
+        else:
+            new_decompressor = lambda: zstandard.ZstdDecompressor().decompressobj()
+        read = self.read_source(self.source)
+        decompressor = new_decompressor()
+        started = False
+        while True:
+            data = read(self.BLOCK)
+            if not data:
+                break
+            while data:
+                started = True
+                try:
+                    block = decompressor.decompress(data)
+                except Exception as error:
+                    raise DecompressionError('compressed input could not be decompressed: {}'.format(error)) from None
+                if block:
+                    self.blocks.put(block)
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = new_decompressor()
+                    started = False
+                else:
+                    data = b''
+        if started:
+            raise DecompressionError('compressed input ended before the end of the stream')
+
+    def fill(self):
+        block = self.blocks.get()
+        if block is None:
+            self.done = True
+        elif isinstance(block, BaseException):
+            self.done = True
+            raise block
+        else:
+            self.buffer += block
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            self.fill()
+        return self.take(size)
+
+    def read1(self, size=-1):
+        if len(self.buffer) == 0 and not self.done:
+            self.fill()
+        return self.take(size)
+
+    def take(self, size):
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def skip(self, size):
+        # Skips 'size' bytes of decompressed data, to resume a run (see Checkpoint)
+        while size > 0:
+            data = self.read(min(size, 1 << 20))
+            if not data:
+                break
+            size -= len(data)
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+        self.source.close()
+
+
+def shard_output(output, k, n):
+    # Output base name of shard 'k' of 'n'
+    return '{}.shard{}of{}'.format(output, k, n)
+
+
+def default_output(filename):
+    # Output base name of an input file: its name without the extension (and without a compression extension)
+    name, extension = os.path.splitext(filename)
+    return (name if extension in DecompressedReader.EXTENSIONS else filename)[:-4]
+
+
+def list_result_files(spec):
+    # The result files of '--files': the files in a directory, the files matching a glob pattern or the files listed
+    # in a manifest (one path per line, relative to the manifest; '#' starts a comment). Hidden files and the files
+    # BLAST-QC writes (results, indexes, checkpoints) are left out of directories and patterns.
+    import glob
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in sorted(os.listdir(spec))]
+    elif glob.has_magic(spec):
+        paths = sorted(glob.glob(spec))
+    else:
+        try:
+            with open(spec) as manifest:
+                lines = [line.split('#', 1)[0].strip() for line in manifest]
+        except OSError as error:
+            raise ValueError('files could not be listed: {}'.format(error)) from None
+        paths = [os.path.join(os.path.dirname(spec), line) for line in lines if line != '']
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if len(missing) != 0:
+            raise ValueError('listed files not found: {}'.format(', '.join(missing)))
+        return paths
+
+    # Every result file suffix of any '--outformat', '--outcompress' and '--subjectfile'
+    own = tuple({suffix for outformat in FilterConfig.CHOICES['outformat']
+                 for outcompress in FilterConfig.CHOICES['outcompress']
+                 for suffix in format_suffixes(outformat, outcompress, True)}) + (ShardIndex.SUFFIX, Checkpoint.SUFFIX)
+    paths = [path for path in paths if os.path.isfile(path) and not os.path.basename(path).startswith('.')
+             and not path.endswith(own)]
+    if len(paths) == 0:
+        raise ValueError('no result files found in \'{}\'.'.format(spec))
+    return paths
+
+
+class Checkpoint:
+    # Progress of a long run for '--checkpoint' and '--resume', kept in {output}.bqcckpt. Every unit of input (a
+    # query, or a chunk of tabular lines) is recorded with the input offset just past it when it is read, and taken
+    # off again once its results are written. Every 'interval' seconds the output files are flushed to disk and the
+    # offset and last query of the units written so far are saved with the output file sizes. A resumed run
+    # truncates the output files to those sizes (dropping any rows written after the checkpoint) and continues
+    # reading the input from that offset.
+    SUFFIX = '.bqcckpt'
+    VERSION = 1
+    # Options that must be the same for a run to be resumed
+    OPTIONS = ('fileformat', 'type', 'number', 'evalue', 'bitscore', 'identity', 'definition', 'order', 'erange',
+               'brange', 'irange', 'shard', 'subjectfile')
+
+    def __init__(self, options, outputs, interval):
+        self.path = options.output + self.SUFFIX
+        self.options = options
+        self.outputs = outputs
+        self.interval = interval
+        self.due = perf_counter() + interval
+        self.pending = deque()      # (end offset, query) of the units read whose results are not written yet
+
+    @classmethod
+    def settings(cls, options):
+        # The options a checkpoint is only valid for, in JSON form
+        settings = {name: getattr(options, name) for name in cls.OPTIONS}
+        if options.sweep != None:
+            settings['sweep'] = [[profile.name] + [getattr(profile, name) for name in FilterConfig.PROFILE_FIELDS]
+                                 for profile in options.sweep]
+        return json.loads(json.dumps(settings))
+
+    @staticmethod
+    def source(path):
+        # Identifies the input file, a checkpoint is not used if the file has changed since
+        stat = os.stat(path)
+        return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    @classmethod
+    def load(cls, options):
+        # The saved checkpoint of a run with these options, or None if there is none. Exits if the checkpoint
+        # cannot be used to resume.
+        path = options.output + cls.SUFFIX
+        try:
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            saved = {}
+        problem = None
+        if saved.get('version') != cls.VERSION:
+            problem = 'the checkpoint file {} could not be read'.format(path)
+        elif saved['source'] != cls.source(options.filename):
+            problem = 'the input file has changed since the checkpoint was saved'
+        elif saved['settings'] != cls.settings(options):
+            problem = 'the checkpoint was saved by a run with different options'
+        else:
+            for output, size in saved['outputs'].items():
+                if not os.path.exists(output) or os.path.getsize(output) < size:
+                    problem = 'the output file {} is missing or shorter than at the checkpoint'.format(output)
+        if problem is not None:
+            print('\n***  Cannot resume: {}. Remove {} to start over.  ***\n'.format(problem, path))
+            sys.exit(1)
+        return saved
+
+    @staticmethod
+    def drop(options):
+        try:
+            os.remove(options.output + Checkpoint.SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def iteration_num(raw):
+        # <Iteration_iter-num> of a raw <Iteration>
+        start = raw.find(b'<Iteration_iter-num>')
+        if start < 0:
+            return None
+        start += len(b'<Iteration_iter-num>')
+        return raw[start:raw.find(b'<', start)].decode()
+
+    @staticmethod
+    def last_qseqid(data):
+        # qseqid of the last line of a chunk of tabular lines
+        start = data.rfind(b'\n', 0, len(data) - 1) + 1
+        tab = data.find(b'\t', start)
+        return data[start:tab if tab >= 0 else len(data) - 1].decode().rstrip('\r')
+
+    def read(self, end, query):
+        self.pending.append((end, query))
+
+    def wrap(self, write):
+        # 'write', followed by saving a checkpoint whenever one is due
+        def write_checked(result):
+            write(result)
+            end, query = self.pending.popleft()
+            if perf_counter() >= self.due:
+                self.save(end, query)
+        return write_checked
+
+    def save(self, end, query):
+        sizes = {}
+        for output in self.outputs:
+            sizes.update(output.sync())
+        saved = {'version': self.VERSION, 'source': self.source(self.options.filename),
+                 'settings': self.settings(self.options), 'offset': end, 'query': query, 'outputs': sizes}
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as checkpoint_file:
+            json.dump(saved, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp, self.path)
+        self.due = perf_counter() + self.interval
+
+
+class ParseCache:
+    # Parse-once cache of every HSP of a results file, taken before any threshold is applied, so the file can be
+    # filtered again with other thresholds, ordering or number of hits without being parsed. Each value is kept in
+    # its own column file of fixed width binary values (strings as one blob plus a column of offsets) in a directory
+    # next to the input ({}.bqccache) or in '--cachedir'. The columns are memory mapped with NumPy and filtered with
+    # 'select_rows' in blocks of whole queries. A cache is only used while the format, size, modification time and a
+    # sampled content hash of the input match those it was built from; otherwise it is rebuilt.
+    VERSION = 1
+    SUFFIX = '.bqccache'
+    BLOCK_ROWS = 1 << 18
+
+    # Column files and the typecode of their values ('s' for strings). Columns are indexed by query
+    # ('query_rows' holds the first row of every query plus the total), by subject or by HSP row.
+    COLUMNS = {
+        "XML": {'query_rows': 'q', 'query_def': 's', 'query_length': 's',
+                'subject_id': 's', 'subject_def': 's', 'subject_accession': 's', 'subject_length': 's',
+                'subject': 'q', 'evalue': 'd', 'bitscore': 'd', 'p_identity': 'd', 'p_conserved': 'd',
+                'deflevel_n': 'i', 'deflevel_p': 'i', 'score': 'q', 'query_start': 'q', 'query_end': 'q',
+                'hit_start': 'q', 'hit_end': 'q', 'query_frame': 'q', 'identity': 'q', 'align_len': 'q',
+                'positive': 'q'},
+        "tab": {'query_rows': 'q', 'qseqid': 's', 'evalue': 'd', 'bitscore': 'd', 'p_identity': 'd',
+                'deflevel_n': 'i', 'deflevel_p': 'i', 'line': 's'},
+    }
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.fileformat = meta['key']['format']
+        self.columns = {}
+
+    @classmethod
+    def directory(cls, options):
+        path = os.path.abspath(options.filename)
+        if options.cachedir == None:
+            return path + cls.SUFFIX
+        # Caches of inputs from different directories may share '--cachedir', so the name includes the full path
+        name = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+        return os.path.join(options.cachedir, '{}.{}{}'.format(os.path.basename(path), name, cls.SUFFIX))
+
+    @staticmethod
+    def key(path, fileformat):
+        # Hashing the whole input would cost as much as reading it, so 64 evenly spaced 64 KiB blocks are hashed
+        stat = os.stat(path)
+        digest = hashlib.blake2b(digest_size=16)
+        block = 1 << 16
+        samples = 64
+        with open(path, 'rb') as results_in:
+            if stat.st_size <= block * samples:
+                digest.update(results_in.read())
+            else:
+                for i in range(samples):
+                    results_in.seek((stat.st_size - block) * i // (samples - 1))
+                    digest.update(results_in.read(block))
+        return {'format': fileformat, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+
+    @classmethod
+    def open(cls, directory, key):
+        # The cache in 'directory' if it was built from the same input, otherwise None
+        meta_path = os.path.join(directory, 'meta.json')
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != cls.VERSION or meta.get('key') != key:
+            return None
+        os.utime(meta_path)     # Last use, for '--cachelimit'
+        return cls(directory, meta)
+
+    @classmethod
+    def drop(cls, directory):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+    @classmethod
+    def evict(cls, cachedir, limit, keep):
+        # Removes the least recently used caches in 'cachedir' until they take up at most 'limit' bytes in total.
+        # The cache in use ('keep') is never removed.
+        caches = []
+        for name in os.listdir(cachedir):
+            directory = os.path.join(cachedir, name)
+            if not name.endswith(cls.SUFFIX) or not os.path.isdir(directory):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(directory, 'meta.json'))
+            except OSError:
+                used = 0        # Unfinished or broken, evicted first
+            size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+            caches.append((used, size, directory))
+        total = sum(size for used, size, directory in caches)
+        for used, size, directory in sorted(caches):
+            if total <= limit:
+                break
+            if os.path.abspath(directory) != os.path.abspath(keep):
+                shutil.rmtree(directory, ignore_errors=True)
+                total -= size
+
+    def array(self, name, typecode=None):
+        # Column 'name' as a memory mapped NumPy array
+        if name not in self.columns:
+            if typecode is None:
+                typecode = self.COLUMNS[self.fileformat][name]
+            path = os.path.join(self.directory, name)
+            if os.path.getsize(path) == 0:
+                self.columns[name] = np.empty(0, np.dtype(typecode))
+            else:
+                self.columns[name] = np.memmap(path, np.dtype(typecode), 'r')
+        return self.columns[name]
+
+    def strings(self, name, index):
+        # The values of string column 'name' at the positions 'index'
+        key = name + '.txt'
+        if key not in self.columns:
+            with open(os.path.join(self.directory, key), 'rb') as blob_file:
+                size = os.fstat(blob_file.fileno()).st_size
+                self.columns[key] = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ) if size != 0 else b''
+        blob = self.columns[key]
+        offsets = self.array(name, 'q')
+        return [blob[start:end].decode() for start, end in zip(offsets[index].tolist(), offsets[index + 1].tolist())]
+
+    def blocks(self, options, stats=None):
+        # Yields the filtered and ranked results as TabBlocks of whole queries of about BLOCK_ROWS rows each
+        if stats is None:
+            stats = Stats()
+        query_rows = self.array('query_rows')
+        nqueries = len(query_rows) - 1
+        first = 0
+        while first < nqueries:
+            last = int(np.searchsorted(query_rows, query_rows[first] + self.BLOCK_ROWS, 'right')) - 1
+            last = min(max(last, first + 1), nqueries)
+            yield self.block(options, first, last, stats)
+            first = last
+
+    def block(self, options, first, last, stats):
+        query_rows = self.array('query_rows')
+        start = int(query_rows[first])
+        end = int(query_rows[last])
+        group = np.repeat(np.arange(last - first), np.diff(query_rows[first:last + 1]))
+        deflevel = 'deflevel_n' if options.type == 'n' else 'deflevel_p'
+
+        def column(name):
+            return self.array(deflevel if name == 'deflevel' else name)[start:end]
+
+        with stats.stage('filter'):
+            rows, found = select_rows(options, group, last - first, column, stats)
+        with stats.stage('format'):
+            return self.format_block(group[rows] + first, np.flatnonzero(~found) + first, rows + start,
+                                     options.subjectfile)
+
+    def format_block(self, queries, nohits, rows, subjectfile=False):
+        if self.fileformat == "XML":
+            query_def = self.strings('query_def', queries)
+            subjects = self.array('subject')[rows]
+            subject_def = self.strings('subject_def', subjects)
+            accessions = self.strings('subject_accession', subjects)
+            values = [self.array(name)[rows].tolist() for name in ('evalue', 'bitscore', 'query_frame', 'query_start',
+                      'query_end', 'hit_start', 'hit_end', 'p_conserved', 'p_identity')]
+            hits = ''.join([ResultWriter.XML_ROW.format(*row) for row in zip(
+                            query_def, self.strings('query_length', queries),
+                            accessions, self.strings('subject_length', subjects),
+                            subject_def, *values)])
+            nohits = ''.join(['{}\tNo hits found.\n'.format(name) for name in self.strings('query_def', nohits)])
+            if subjectfile:
+                # Ids are hashed once for every subject of the block
+                unique, inverse = np.unique(subjects, return_inverse=True)
+                unique_ids = [subject_id(accession, def_) for accession, def_ in zip(
+                              self.strings('subject_accession', unique), self.strings('subject_def', unique))]
+                ids = [unique_ids[i] for i in inverse.tolist()]
+                header = ''.join(['{}\t{}\n'.format(name, id) for name, id in zip(query_def, ids)])
+                return TabBlock(hits, header, nohits, list(zip(ids, accessions, subject_def)))
+            header = ''.join(['{}\t{}\n'.format(name, def_) for name, def_ in zip(query_def, subject_def)])
+        else:
+            lines = self.strings('line', rows)
+            hits = ''.join(lines)
+            header = ''.join(['{}\t{}\n'.format(qseqid, line.split('\t', 2)[1])
+                              for qseqid, line in zip(self.strings('qseqid', queries), lines)])
+            nohits = ''.join(['{}\tNo hits found.\n'.format(qseqid) for qseqid in self.strings('qseqid', nohits)])
+        return TabBlock(hits, header, nohits)
+
+
+class CacheBuilder:
+    # Writes the columns of a ParseCache as queries are extracted from the input. Values are appended to the column
+    # files in batches, so the results file is never held in memory. The cache is written to a temporary directory
+    # that replaces the old cache only once it is complete.
+    BATCH_ROWS = 1 << 16
+
+    def __init__(self, directory, fileformat):
+        self.directory = directory
+        self.fileformat = fileformat
+        self.columns = ParseCache.COLUMNS[fileformat]
+        parent = os.path.dirname(directory)
+        if parent != '':
+            os.makedirs(parent, exist_ok=True)
+        self.temp = '{}.tmp{}'.format(directory, os.getpid())
+        os.mkdir(self.temp)
+        self.files = {}
+        self.sizes = {}
+        for name, typecode in self.columns.items():
+            self.files[name] = open(os.path.join(self.temp, name), 'wb')
+            if typecode == 's':
+                self.files[name + '.txt'] = open(os.path.join(self.temp, name + '.txt'), 'wb')
+                self.sizes[name] = 0
+                self.files[name].write(array('q', [0]).tobytes())
+        self.files['query_rows'].write(array('q', [0]).tobytes())
+        self.pending = {name: [] for name in self.columns}
+        self.rows = 0           # HSP rows added so far
+        self.queries = 0        # Queries added so far
+        self.subjects = 0       # Subjects added so far (XML)
+        self.pending_rows = 0
+
+    @staticmethod
+    def iteration_columns(extracted):
+        # Column values of a list of queries with all of their hits, as returned by 'extract_iteration'. Subjects
+        # are numbered from 0 and 'query_rows' holds the number of rows of each query; see 'add'.
+        columns = {name: [] for name in ParseCache.COLUMNS["XML"]}
+        subjects = 0
+        for cur_query, hits in extracted:
+            columns['query_def'].append(cur_query.def_)
+            columns['query_length'].append(cur_query.length)
+            columns['query_rows'].append(len(hits))
+            subject = None
+            for hit in hits:
+                if hit.subject is not subject:
+                    subject = hit.subject
+                    columns['subject_id'].append(subject.id)
+                    columns['subject_def'].append(subject.def_)
+                    columns['subject_accession'].append(subject.accession)
+                    columns['subject_length'].append(subject.length)
+                    deflevel_n, deflevel_p = subject.deflevels
+                    subjects += 1
+                columns['subject'].append(subjects - 1)
+                columns['deflevel_n'].append(deflevel_n)
+                columns['deflevel_p'].append(deflevel_p)
+                for name in ('evalue', 'bitscore', 'p_identity', 'p_conserved', 'score', 'query_start', 'query_end',
+                             'hit_start', 'hit_end', 'query_frame', 'identity', 'align_len', 'positive'):
+                    columns[name].append(getattr(hit, name))
+        return columns
+
+    @staticmethod
+    def tab_columns(queries):
+        # Column values of the queries of a chunk of tabular lines, as returned by 'extract_tab_lines'. Lines are
+        # kept with their newline.
+        columns = {name: [] for name in ParseCache.COLUMNS["tab"]}
+        for qseqid, hits in queries:
+            columns['qseqid'].append(qseqid)
+            columns['query_rows'].append(len(hits))
+            for hit in hits:
+                deflevel_n, deflevel_p = hit.subject.deflevels
+                columns['deflevel_n'].append(deflevel_n)
+                columns['deflevel_p'].append(deflevel_p)
+                columns['evalue'].append(hit.evalue)
+                columns['bitscore'].append(hit.bitscore)
+                columns['p_identity'].append(hit.p_identity)
+                columns['line'].append(hit.line + '\n')
+        return columns
+
+    def add(self, columns):
+        # Appends the column values of some queries, see 'iteration_columns', 'tab_columns' and
+        # TabularChunk.cache_columns. Values may be lists or NumPy arrays; a string column may also be given as the
+        # raw bytes of all its values plus their lengths.
+        pending = self.pending
+        for name, values in columns.items():
+            if name == 'query_rows':
+                ends = []
+                for count in list(values):
+                    self.rows += int(count)
+                    ends.append(self.rows)
+                values = ends
+            elif name == 'subject':
+                values = [subject + self.subjects for subject in values]
+            pending[name].append(values)
+        self.queries += len(columns['query_rows'])
+        if 'subject_id' in columns:
+            self.subjects += len(columns['subject_id'])
+        self.pending_rows += len(columns['evalue']) + len(columns['query_rows'])
+        if self.pending_rows >= self.BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for name, pieces in self.pending.items():
+            typecode = self.columns[name]
+            for values in pieces:
+                if typecode != 's':
+                    if isinstance(values, list):
+                        self.files[name].write(array(typecode, values).tobytes())
+                    else:
+                        self.files[name].write(values.astype(np.dtype(typecode)).tobytes())
+                    continue
+                if isinstance(values, tuple):
+                    data, lengths = values
+                else:
+                    data = [str(value).encode() for value in values]
+                    lengths = [len(value) for value in data]
+                    data = b''.join(data)
+                offsets = self.sizes[name] + np.cumsum(lengths, dtype=np.int64)
+                if len(offsets) != 0:
+                    self.sizes[name] = int(offsets[-1])
+                self.files[name + '.txt'].write(data)
+                self.files[name].write(offsets.tobytes())
+            pieces.clear()
+        self.pending_rows = 0
+
+    def commit(self, key):
+        self.flush()
+        for column_file in self.files.values():
+            column_file.close()
+        with open(os.path.join(self.temp, 'meta.json'), 'w') as meta_file:
+            json.dump({'version': ParseCache.VERSION, 'key': key, 'queries': self.queries, 'rows': self.rows},
+                      meta_file)
+        ParseCache.drop(self.directory)
+        os.rename(self.temp, self.directory)
+        return ParseCache.open(self.directory, key)
+
+    def abort(self):
+        for column_file in self.files.values():
+            column_file.close()
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+
+class FilterConfig:
+    # The options of a run, under the long names of the command line options (see BLASTQC.CLI), e.g.
+    # FilterConfig(fileformat='XML', type='n', evalue=1e-10, number=1). Options left out take the command line
+    # defaults. Unknown options raise TypeError, invalid or conflicting ones ValueError. As on the command line some
+    # options are filled in from others: the output name, '--shard' as a (k, N) tuple, '--sweep' (a JSON file or a
+    # list of profiles) as one FilterConfig per profile, ...
+    DEFAULTS = {'filename': None, 'fileformat': None, 'output': None, 'outformat': 'tab', 'outcompress': None,
+                'outbuffer': 1 << 20,
+                'parallel': None, 'batchsize': 100, 'chunksize': 4 << 20, 'spilllimit': 1000000,
+                'subjectcache': 65536, 'subjectfile': False, 'shard': None, 'merge': None,
+                'index': False, 'indexstep': 1 << 20, 'sweep': None, 'cache': False, 'cachedir': None,
+                'cachelimit': None, 'rebuildcache': False, 'dropcache': False, 'live': False, 'flush': False,
+                'checkpoint': None, 'resume': False, 'files': None, 'concurrentfiles': None, 'mergeoutput': False,
+                'stats': None, 'profile': None, 'type': None, 'number': 0,
+                'evalue': float('Inf'), 'bitscore': -1, 'identity': -1, 'definition': -1, 'order': 'e',
+                'erange': 0, 'brange': 0, 'irange': 0}
+    CHOICES = {'fileformat': ('XML', 'tab'), 'type': ('p', 'n'), 'order': ('e', 'b', 'i', 'd'),
+               'outformat': ('tab', 'parquet', 'sqlite'), 'outcompress': (None, 'gzip', 'zstd')}
+
+    def __init__(self, **options):
+        unknown = [name for name in options if name not in self.DEFAULTS]
+        if len(unknown) != 0:
+            raise TypeError('unknown option(s): {}'.format(', '.join(unknown)))
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, options.get(name, default))
+        self.check()
+
+    def check(self):
+        for name, choices in self.CHOICES.items():
+            value = getattr(self, name)
+            if value is None and None not in choices:
+                raise ValueError('{} is required.'.format(name))
+            if value not in choices:
+                raise ValueError('invalid {} {!r}, choose from {}.'.format(
+                    name, value, ', '.join(repr(choice) for choice in choices if choice is not None)))
+        self.check_ranges()
+        if self.parallel == None:
+            self.parallel = os.cpu_count() or 1
+
+        if (self.shard != None or self.index) and self.filename == None:
+            raise ValueError('an input file is required to build or use a shard index.')
+        if self.shard != None:
+            try:
+                k, n = (int(part) for part in (self.shard.split('/') if isinstance(self.shard, str) else self.shard))
+            except (TypeError, ValueError):
+                raise ValueError('shard must be given as k/N, e.g. \'-sh 2/8\'.') from None
+            if not 1 <= k <= n:
+                raise ValueError('shard k/N must satisfy 1 <= k <= N.')
+            if self.output == '-':
+                raise ValueError('shard results cannot be written to stdout.')
+            self.shard = (k, n)
+        if (self.cache or self.rebuildcache or self.dropcache) and self.filename == None:
+            raise ValueError('an input file is required to use a parse cache.')
+        if self.cache and self.shard != None:
+            raise ValueError('a parse cache cannot be used with shards.')
+        if self.cachelimit != None and self.cachedir == None:
+            raise ValueError('cachelimit requires a cache directory (-cd).')
+        if self.rebuildcache:
+            self.cache = True
+        if self.cache and not load_optional('numpy', 'np'):
+            print('NumPy is not installed, the parse cache is not used.', file=sys.stderr)
+        if (self.shard != None or self.index) and DecompressedReader.file_compression(self.filename) != None:
+            raise ValueError('shards and the shard index need an uncompressed input file.')
+        if self.outcompress != None:
+            if self.output == '-':
+                raise ValueError('compressed results cannot be written to stdout.')
+            if self.outcompress == 'zstd' and self.outformat == 'tab' and not load_optional('zstandard'):
+                raise ValueError('zstd output requires the \'zstandard\' module.')
+            if self.outformat == 'sqlite':
+                raise ValueError('sqlite output cannot be compressed.')
+        if self.outformat != 'tab':
+            if self.output == '-':
+                raise ValueError('{} output cannot be written to stdout.'.format(self.outformat))
+            if self.checkpoint != None or self.resume:
+                raise ValueError('checkpoints can only be used with text output (-of tab).')
+            if self.outformat == 'parquet' and not (load_optional('pyarrow', 'pa')
+                                                    and load_optional('pyarrow.parquet', 'pq')):
+                raise ValueError('parquet output requires the \'pyarrow\' module.')
+        if self.live:
+            if self.shard != None or self.cache:
+                raise ValueError('live mode cannot be used with shards or a parse cache.')
+            self.parallel = 1
+        if self.resume and self.checkpoint == None:
+            self.checkpoint = 60.0
+        if self.checkpoint != None:
+            if self.filename == None or self.output == '-':
+                raise ValueError('checkpoints require an input file and output files.')
+            if self.cache:
+                raise ValueError('checkpoints cannot be used with a parse cache.')
+            if self.checkpoint < 0:
+                raise ValueError('checkpoint interval must not be negative.')
+        if self.outbuffer < 1:
+            raise ValueError('outbuffer must be at least 1.')
+        if self.batchsize < 1:
+            raise ValueError('batchsize must be at least 1.')
+        if self.chunksize < 1:
+            raise ValueError('chunksize must be at least 1.')
+        if self.spilllimit < 0:
+            raise ValueError('spilllimit must not be negative.')
+        if self.subjectcache < 0:
+            raise ValueError('subjectcache must not be negative.')
+        if self.subjectfile:
+            if self.fileformat != "XML":
+                raise ValueError('a subjects file can only be written for XML results (tabular results have no '
+                                 'descriptions in the header file).')
+            if self.outformat != 'tab' or self.output == '-':
+                raise ValueError('a subjects file can only be written with text output files (-of tab).')
+        if self.merge != None and self.merge < 1:
+            raise ValueError('merge must be given the number of shards (N >= 1).')
+        if self.files != None:
+            self.check_files()
+        elif self.mergeoutput:
+            raise ValueError('mergeoutput can only be used with files (-fs).')
+
+        if self.output == None and self.filename != None:
+            self.output = default_output(self.filename)
+        elif self.output == None and (self.files == None or self.mergeoutput):
+            self.output = "BLASTQC.out"
+        if self.shard != None:
+            self.output = shard_output(self.output, *self.shard)
+        if self.sweep != None:
+            if self.output == '-':
+                raise ValueError('sweep results cannot be written to stdout.')
+            self.sweep = self.read_profiles(self.sweep)
+
+
+    def check_files(self):
+        # Checks the options of files mode and lists the files. Without '--mergeoutput' the output is the directory
+        # the results of every file are written to, by default next to the file.
+        if self.filename != None or self.shard != None or self.merge != None or self.index:
+            raise ValueError('files (-fs) cannot be used with an input file, shards or a shard index.')
+        if self.cache or self.dropcache or self.checkpoint != None or self.live:
+            raise ValueError('files (-fs) cannot be used with a parse cache, checkpoints or live mode.')
+        if self.output == '-':
+            raise ValueError('the results of files (-fs) cannot be written to stdout.')
+        if self.concurrentfiles == None:
+            self.concurrentfiles = self.parallel
+        if self.concurrentfiles < 1:
+            raise ValueError('concurrentfiles must be at least 1.')
+        self.files = list_result_files(self.files)
+        if not self.mergeoutput:
+            outputs = [self.file_output(path) for path in self.files]
+            if len(set(outputs)) != len(outputs):
+                raise ValueError('files with the same name would write to the same output files.')
+
+
+    def file_output(self, path):
+        # Output base name of a file of files mode (without '--mergeoutput')
+        if self.output == None:
+            return default_output(path)
+        return os.path.join(self.output, os.path.basename(default_output(path)))
+
+
+    def for_file(self, filename, output, shard=None):
+        # The options to run one file (or shard of a file) of files mode with on its own, in a worker process
+        config = copy.copy(self)
+        config.filename = filename
+        config.files = None
+        config.parallel = 1
+        config.profile = None
+        config.shard = shard
+        config.output = output if shard is None else shard_output(output, *shard)
+        if self.sweep != None:
+            config.sweep = []
+            for profile in self.sweep:
+                file_profile = copy.copy(config)
+                for field in self.PROFILE_FIELDS:
+                    setattr(file_profile, field, getattr(profile, field))
+                file_profile.name = profile.name
+                file_profile.output = '{}.{}'.format(config.output, profile.name)
+                config.sweep.append(file_profile)
+        return config
+
+
+    def check_ranges(self, where=''):
+        if self.erange != 0 and self.order != 'e':
+            raise ValueError('erange cannot be used{}. Must order by evalue if this functionality is desired.'
+                             .format(where))
+        if self.brange != 0 and self.order != 'b':
+            raise ValueError('brange cannot be used{}. Must order by bitscore if this functionality is desired.'
+                             .format(where))
+        if self.irange != 0 and self.order != 'i':
+            raise ValueError('irange cannot be used{}. Must order by identity if this functionality is desired.'
+                             .format(where))
+
+
+    # Filter and ordering options a sweep profile may set, and their types. Options a profile leaves out are taken
+    # from the command line.
+    PROFILE_FIELDS = {'number': int, 'evalue': float, 'bitscore': float, 'identity': float, 'definition': int,
+                      'order': str, 'erange': float, 'brange': float, 'irange': float}
+
+    def read_profiles(self, sweep):
+        # Reads the sweep profiles: a JSON list of objects, each with a unique 'name' and any of PROFILE_FIELDS,
+        # e.g. [{"name": "strict", "evalue": 1e-10, "number": 1}, {"name": "lenient", "evalue": 0.01}], from the
+        # file 'sweep' or given as a list. The results of a profile are written to {output}.{name}.*
+        entries = sweep
+        if isinstance(sweep, (str, os.PathLike)):
+            try:
+                with open(sweep) as profiles_file:
+                    entries = json.load(profiles_file)
+            except (OSError, ValueError) as error:
+                raise ValueError('sweep profiles could not be read: {}'.format(error)) from None
+        if not isinstance(entries, list) or len(entries) == 0:
+            raise ValueError('sweep profiles must be a list of objects.')
+
+        profiles = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get('name'), str) or entry['name'] == '':
+                raise ValueError('every sweep profile must be an object with a name.')
+            if entry['name'] in [profile.name for profile in profiles]:
+                raise ValueError('sweep profile \'{}\' is defined twice.'.format(entry['name']))
+            profile = copy.copy(self)
+            profile.name = entry['name']
+            profile.output = '{}.{}'.format(self.output, profile.name)
+            for field, value in entry.items():
+                if field == 'name':
+                    continue
+                if field not in self.PROFILE_FIELDS:
+                    raise ValueError('unknown option \'{}\' in sweep profile \'{}\'.'.format(field, profile.name))
+                try:
+                    setattr(profile, field, self.PROFILE_FIELDS[field](value))
+                except (TypeError, ValueError):
+                    raise ValueError('invalid {} in sweep profile \'{}\'.'.format(field, profile.name)) from None
+            if profile.order not in ('e', 'b', 'i', 'd'):
+                raise ValueError('invalid order in sweep profile \'{}\'.'.format(profile.name))
+            profile.check_ranges(' (sweep profile \'{}\')'.format(profile.name))
+            profiles.append(profile)
+        return profiles
+
+
+class BLASTQC:
+    def __init__(self, options=None):
+        if options is None:
+            options = self.CLI()
+        self.clOptions = options
+        self.stats = Stats(options.stats != None)
+        self.checkpoint = None
+        self.input_start = 0    # Input offset reading starts from
+        self.read_hits = {}     # Hits already taken out of the tree of an <Iteration> element (see 'iterate_xml')
+        self.subjects = SubjectTable(options.subjectcache, options.type)
+
+
+    def run(self):
+        # With '--stats' a JSON report of the run is written once it is done, with '--profile' the run is profiled
+        # with cProfile (the main process only)
+        profiler = None
+        if self.clOptions.profile != None:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self.stats.start()
+        self.outputs = []
+        self.written = []       # Output base names and rows written by worker processes (files mode)
+        self.failed = False     # Some of the files of files mode could not be processed
+        try:
+            self.run_filters()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.clOptions.profile)
+        if self.stats.enabled:
+            self.stats.report(self.clOptions, [(output.name, output.rows) for output in self.outputs] + self.written)
+        if self.failed:
+            sys.exit(1)
+
+
+    def run_filters(self):
+        if self.clOptions.index:
+            ShardIndex.load_or_build(self.clOptions.filename, self.clOptions.fileformat, self.clOptions.indexstep)
+            return
+        if self.clOptions.merge:
+            self.merge_shards()
+            return
+        if self.clOptions.dropcache:
+            ParseCache.drop(ParseCache.directory(self.clOptions))
+            return
+        if self.clOptions.files != None:
+            self.process_files()
+            return
+
+        # One set of output files per sweep profile, or just the one. A resumed run appends to the output files of
+        # the checkpoint.
+        profiles = self.clOptions.sweep if self.clOptions.sweep != None else [self.clOptions]
+        resumed = None
+        if self.clOptions.resume:
+            resumed = Checkpoint.load(self.clOptions)
+        elif self.clOptions.checkpoint != None:
+            Checkpoint.drop(self.clOptions)
+        try:
+            for profile in profiles:
+                self.outputs.append(open_writer(profile, resumed['outputs'] if resumed is not None else None))
+            self.output = self.outputs[0]
+            if self.clOptions.checkpoint != None:
+                self.checkpoint = Checkpoint(self.clOptions, self.outputs, self.clOptions.checkpoint)
+                if resumed is not None:
+                    self.input_start = resumed['offset']
+            if self.clOptions.cache and load_optional('numpy', 'np'):
+                cache = self.load_cache()
+                for profile, output in zip(profiles, self.outputs):
+                    for block in cache.blocks(profile, self.stats):
+                        with self.stats.stage('write'):
+                            output.write_block(block)
+            elif self.clOptions.sweep != None:
+                self.sweep()
+            elif self.clOptions.fileformat == "XML":
+                self.parseXML()
+            elif self.clOptions.fileformat == "tab":
+                self.parseTab()
+            if self.checkpoint is not None:
+                Checkpoint.drop(self.clOptions)
+        finally:
+            for output in self.outputs:
+                output.close()
+
+
+    # Initializes the argument parser and reads command line args to get filenames, filters and thresholds, as a
+    # FilterConfig. Invalid options are reported by the parser.
+    # 'argparse' allows for easy creation of a command line interface menu. If modifactions are desired,
+    # more info can be found at: 'https://docs.python.org/3/library/argparse.html'
+    def CLI(self):
+        import argparse
+        parser = argparse.ArgumentParser(argument_default=argparse.SUPPRESS)
+        parser.add_argument("-f", "--filename", help="Specifiy the Blast XML results input file.\n(required)", type=str)
+
+        parser.add_argument("-ff", "--fileformat", help="Specifiy the Blast results file format (Tabular or XML).\n(required)",
+                                                choices=["XML", "tab"], required=True, type=str)
+
+        parser.add_argument("-o", "--output", help="Specify the output file base name (no extension). "
+                                                "Defaults to base name of input file. Use '-' to write the hits to stdout.", type=str)
+
+        parser.add_argument("-of", "--outformat", help="Specify the format of the results: the text files (tab, the "
+                                                "default), Parquet files with typed columns ({}.hits.parquet and "
+                                                "{}.nohits.parquet, requires the 'pyarrow' module) or a SQLite database "
+                                                "({}.sqlite) with tables 'hits' and 'nohits', indexed by query name and accession.",
+                                                choices=["tab", "parquet", "sqlite"], type=str)
+
+        parser.add_argument("-oc", "--outcompress", help="Write the result files compressed with gzip ({}.hits.txt.gz etc.) "
+                                                "or zstd ({}.hits.txt.zst, requires the 'zstandard' module). Compressed input "
+                                                "(gzip, bgzip or zstd) is detected and read without this option.",
+                                                choices=["gzip", "zstd"], type=str)
+
+        parser.add_argument("-ob", "--outbuffer", help="Specify the size in bytes of the write buffer kept for each output file."
+                                                "\n(Int value)", type=int)
+
+        parser.add_argument("-p", "--parallel", help="Set number of worker processes used to parse, filter and rank queries in parallel. "
+                                                "Set to 1 if sequential processing is desired. (Defaults to #of CPU cores avalible.)"
+                                                "(INT value)", type=int)
+
+        parser.add_argument("-bs", "--batchsize", help="Specify the number of queries handed to a worker process at a time "
+                                                "when processing in parallel.\n(Int value)", type=int)
+
+        parser.add_argument("-cs", "--chunksize", help="Specify the size in bytes of the chunks tabular results are read and "
+                                                "filtered in.\n(Int value)", type=int)
+
+        parser.add_argument("-sl", "--spilllimit", help="Specify the number of hits of a query kept in memory for ordering. "
+                                                "When a query has more hits to order (all of them with '-n 0', or a range with "
+                                                "'-er/-br/-ir'), they are sorted in runs of this many hits that are written to "
+                                                "temporary files and merged as the results are written. 0 keeps every hit in "
+                                                "memory.\n(Int value)", type=int)
+
+        parser.add_argument("-sc", "--subjectcache", help="Specify the number of subjects kept interned. A subject hit by "
+                                                "many queries is then kept in memory once and its definition level counted once; "
+                                                "the least recently used subjects are dropped first. 0 turns interning off."
+                                                "\n(Int value)", type=int)
+
+        parser.add_argument("-sf", "--subjectfile", help="Write every subject once to {output}.subjects (subject_id, "
+                                                "accession_number and subject_description) instead of its description on every "
+                                                "line of {output}.hits.header, which then holds query_name and subject_id. "
+                                                "(XML results, text output only)", action="store_true")
+
+        parser.add_argument("-sh", "--shard", help="Process only shard k of N of the input file, e.g. '-sh 2/8'. Shards are "
+                                                "split on query boundaries using an index of the input file ({}.bqcidx), "
+                                                "which is built on first use and reused after. Results are written to "
+                                                "{output}.shardKofN.* (see '-m').", type=str)
+
+        parser.add_argument("-m", "--merge", help="Merge the results of shards 1 to N (written with '-sh k/N') into the "
+                                                "output files and exit.\n(Int value)", type=int)
+
+        parser.add_argument("-ix", "--index", help="Build (or refresh) the shard index of the input file and exit.",
+                                                action="store_true")
+
+        parser.add_argument("-is", "--indexstep", help="Specify the spacing in bytes of the query boundaries recorded in "
+                                                "the shard index.\n(Int value)", type=int)
+
+        parser.add_argument("-sw", "--sweep", help="Specify a JSON file with a list of named filter profiles, e.g. "
+                                                "'[{\"name\": \"strict\", \"evalue\": 1e-10, \"number\": 1}, {\"name\": \"lenient\", \"evalue\": 0.01}]'. "
+                                                "The input is parsed once and the results of every profile are written to "
+                                                "{output}.{name}.*. A profile may set number, evalue, bitscore, identity, "
+                                                "definition, order, erange, brange and irange; other values are taken from the "
+                                                "command line.", type=str)
+
+        parser.add_argument("-c", "--cache", help="Use a cache of the parsed input file. The first run parses the whole file "
+                                                "into a binary cache ({}.bqccache); later runs with any thresholds, order or "
+                                                "number of hits read the cache instead of parsing the file again. The cache is "
+                                                "rebuilt when the input file changes. (Requires NumPy)", action="store_true")
+
+        parser.add_argument("-cd", "--cachedir", help="Specify a directory to keep parse caches in, instead of next to the "
+                                                "input file.", type=str)
+
+        parser.add_argument("-cl", "--cachelimit", help="Specify the maximum total size in bytes of the caches kept in the "
+                                                "cache directory (-cd). The least recently used caches are removed first.\n(Int value)",
+                                                type=int)
+
+        parser.add_argument("-rc", "--rebuildcache", help="Rebuild the parse cache of the input file even if it is up to date.",
+                                                action="store_true")
+
+        parser.add_argument("-dc", "--dropcache", help="Remove the parse cache of the input file and exit.", action="store_true")
+
+        parser.add_argument("-lv", "--live", help="Live mode for piping BLAST output straight in, e.g. 'blastn ... -outfmt 5 | "
+                                                "python BLAST-QC.py -lv -fl ...'. The input is read as it arrives and the results "
+                                                "of each query are written as soon as the query is complete, instead of waiting "
+                                                "for full blocks of input. Queries are processed in this process (-p is ignored).",
+                                                action="store_true")
+
+        parser.add_argument("-fl", "--flush", help="Flush the output files after the results of every query (or chunk of "
+                                                "tabular lines), so they can be read while the run goes on.", action="store_true")
+
+        parser.add_argument("-ck", "--checkpoint", help="Save a checkpoint of the run every this many seconds "
+                                                "({output}.bqcckpt), so that a run that is stopped can be continued with '-rs'. "
+                                                "The checkpoint is removed when the run completes.\n(Float value)", type=float)
+
+        parser.add_argument("-rs", "--resume", help="Continue a run from its checkpoint (see '-ck'): the output files are "
+                                                "truncated to their size at the checkpoint and the input is read on from there. "
+                                                "Without a checkpoint the run starts from the beginning. Checkpoints are saved "
+                                                "every 60 seconds unless '-ck' is given.", action="store_true")
+
+        parser.add_argument("-fs", "--files", help="Process many result files in one run: a directory (every file in it except "
+                                                "the results BLAST-QC writes), a glob pattern (quoted) or a manifest file listing "
+                                                "one path per line. The files share one pool of '-p' worker processes, largest "
+                                                "files first, and large uncompressed files are split into shards so several "
+                                                "workers share them. The results of each file are written to {name}.* as for a "
+                                                "single file, in the directory '-o' if given (see '-mo'). A line of progress is "
+                                                "printed as each file is done and a summary at the end.", type=str)
+
+        parser.add_argument("-cf", "--concurrentfiles", help="Specify the maximum number of files in progress at once with "
+                                                "'-fs'. (Defaults to '-p'.)\n(Int value)", type=int)
+
+        parser.add_argument("-mo", "--mergeoutput", help="With '-fs' write the results of all the files to one set of "
+                                                "output files ({output}.*, by default BLASTQC.out.*), in the order the "
+                                                "files are listed.", action="store_true")
+
+        parser.add_argument("-st", "--stats", help="Write a JSON report of the run to this file ('-' for stderr): the wall and "
+                                                "CPU time of each stage, the number of queries and HSPs seen, the HSPs dropped by "
+                                                "each threshold, the rows written and the peak memory use.", type=str)
+
+        parser.add_argument("-pf", "--profile", help="Profile the run with cProfile and write the profile to this file "
+                                                "(readable with the 'pstats' module). Only the main process is profiled.",
+                                                type=str)
+
+        parser.add_argument("-t", "--type", help="Specify what type of BLAST you are running\n(Protein or Nucleotide)."
+                                                    " (required)", choices=["p", "n"], type=str, required=True)
+
+        parser.add_argument("-n", "--number", help="Specify the number of hits to return per query sequence. "
+                                                "Defaults to return all hits that fit input threshold(s).\n(Int value)",
+                                                    type=int)
+
+        parser.add_argument("-e", "--evalue", help="Specify an e-value threshold.\n(Maximum acceptable evalue)"
+                                                "(Float value)", type=float)
+
+        parser.add_argument("-b", "--bitscore", help="Specify a bit-score threshold.\n(Minimum acceptable bitscore)"
+                                                    "(Float value)", type=float)
+
+        parser.add_argument("-i", "--identity", help="Specify a threshold in the percent identity of a hit."
+                                                    "(Calculated value. Not to be confused with identity value)"
+                                                    "\n(Minimum acceptable percentage) (Float value)",
+                                                    type=float)
+
+        parser.add_argument("-d", "--definition", help="Specify a threshold in the level of definition provided."
+                                                    "This is defined by the number of line separators (titles) are in the Hit "
+                                                    "definition '<Hit_def>' of the XML file, or salltitles column of the tabular output"
+                                                    " (must enable the salltitles column in the BLAST tabular output using -outfmt \"6 std salltitles\").\n(Int value)",
+                                                    type=int)
+
+        parser.add_argument("-or", "--order", help="Specify the order of the results. By lowest evalue, highest bitscore, "
+                                                    "highest percent identity or most detailed definition data."
+                                                    "\n(default: by evalue- 'e') (if ordering by definition with tabular output you must enable the salltitles column in the BLAST tabular output using -outfmt \"6 std salltitles\")",
+                                                    type=str, choices=["e", "b", "i", "d"])
+
+        parser.add_argument("-er", "--erange", help="Sets a range of acceptable deviation from the lowest evalue hit "
+                                                    "in which a more detailed definition would be prefered. "
+                                                    "Must be ordered by evalue. (must enable the salltitles column in the BLAST tabular output using -outfmt \"6 std salltitles\" if using tabular output from BLAST)", type=float)
+
+        parser.add_argument("-br", "--brange", help="Sets a range of acceptable deviation from the highest bitscore hit "
+                                                    "in which a more detailed definition would be prefered. "
+                                                    "Must be ordered by bitscore. (must enable the salltitles column in the BLAST tabular output using -outfmt \"6 std salltitles\" if using tabular output from BLAST)", type=float)
+
+        parser.add_argument("-ir", "--irange", help="Sets a range of acceptable deviation from the highest percent identity "
+                                                    "hit in which a more detailed definition would be prefered. "
+                                                    "Must be ordered by percent identity. (must enable the salltitles column in the BLAST tabular output using -outfmt \"6 std salltitles\" if using tabular output from BLAST)", type=float)
+
+        # Options left out are not set here, so they take the defaults of FilterConfig
+        args = parser.parse_args()
+        try:
+            return FilterConfig(**vars(args))
+        except ValueError as error:
+            parser.error('{}\nuse \'-h\' or \'--help\' to display help menu.'.format(error))
+
+    
+    def parseXML(self):
+        # ElementTree is used to parse the XML file to locate data and extract the numerical values from the lines.
+        # The file is streamed with 'iterparse' rather than loaded whole, so each <Iteration> is filtered and written
+        # as soon as its closing tag is read and is then freed. Peak memory is tied to the largest single query
+        # instead of the size of the results file. More info can be found at:
+        # 'https://docs.python.org/3/library/xml.etree.elementtree.html#xml.etree.ElementTree.iterparse'
+        self.read_xml(self.parse_iteration, process_batch, self.write_query)
+
+
+    def read_xml(self, parse, process, write):
+        # Runs 'parse' on every <Iteration> element of the input and hands each result to 'write', in input order.
+        # When running in parallel, batches of raw <Iteration> elements are handled by 'process' in the workers.
+        try:
+            source = self.open_input()
+        except OSError:
+            traceback.print_exc()
+            print('\n***  XML file could not be parsed. Check the BLAST results file  ***\n')
+            sys.exit(1)
+
+        if self.checkpoint is not None:
+            write = self.checkpoint.wrap(write)
+        try:
+            if self.clOptions.parallel > 1:
+                self.run_parallel(self.stats.timed(self.batches(self.iterate_xml_raw(source)), 'read'), write, process)
+            elif self.clOptions.shard != None or self.checkpoint is not None or self.clOptions.live:
+                # A shard (or the rest of a file after a checkpoint) is not a whole XML document, so its queries are
+                # split out and parsed one at a time. This also gives the offset of each query for checkpoints, and
+                # in live mode each query is handled as soon as its closing tag has been read.
+                for raw in self.stats.timed(self.iterate_xml_raw(source), 'read'):
+                    write(parse(self.element(raw)))
+            else:
+                for query in self.stats.timed(self.iterate_xml(source), 'read'):
+                    write(parse(query))
+        except (ET.ParseError, DecompressionError):
+            traceback.print_exc()
+            print('\n***  XML file could not be parsed. Check the BLAST results file  ***\n')
+            sys.exit(1)
+
+
+    def load_cache(self):
+        # Opens the parse cache of the input file, building it first if it is missing or out of date
+        directory = ParseCache.directory(self.clOptions)
+        with self.stats.stage('cache'):
+            key = ParseCache.key(self.clOptions.filename, self.clOptions.fileformat)
+            cache = None if self.clOptions.rebuildcache else ParseCache.open(directory, key)
+        if cache is None:
+            builder = CacheBuilder(directory, self.clOptions.fileformat)
+
+            def add(columns):
+                with self.stats.stage('write'):
+                    builder.add(columns)
+            try:
+                if self.clOptions.fileformat == "XML":
+                    self.read_xml(self.cache_iteration, extract_batch, add)
+                else:
+                    self.read_tab(self.cache_tab_chunk, extract_batch, add)
+            except BaseException:
+                builder.abort()
+                raise
+            cache = builder.commit(key)
+        if self.clOptions.cachelimit != None:
+            ParseCache.evict(self.clOptions.cachedir, self.clOptions.cachelimit, directory)
+        return cache
+
+
+    def open_input(self):
+        # Opens the results file for reading (stdin if no file was given). With '--shard' only the byte range of
+        # that shard can be read from the returned file. A resumed run starts reading at 'input_start'. Compressed
+        # input is decompressed while it is read; offsets are then those of the decompressed data.
+        if self.clOptions.filename == None:
+            results_in = self.open_source(sys.stdin.buffer)
+        else:
+            results_in = self.open_source(self.clOptions.filename)
+        if isinstance(results_in, DecompressedReader):
+            results_in.skip(self.input_start)
+            return results_in
+        if self.clOptions.filename == None:
+            return results_in
+        if self.clOptions.shard != None:
+            index = ShardIndex.load_or_build(self.clOptions.filename, self.clOptions.fileformat, self.clOptions.indexstep)
+            start, end = index.shard_range(*self.clOptions.shard)
+            self.input_start = max(self.input_start, start)
+            results_in.seek(self.input_start)
+            return RangeReader(results_in, end - self.input_start)
+        results_in.seek(self.input_start)
+        return results_in
+
+
+    def open_source(self, source):
+        # A binary file to read results from, given the path of a results file or a binary file object. Compressed
+        # results are decompressed while they are read (see DecompressedReader).
+        path = None
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            source = open(path, 'rb')
+        if hasattr(source, 'peek'):
+            head = source.peek(4)[:4]
+        elif source.seekable():
+            head = source.read(4)
+            source.seek(-len(head), os.SEEK_CUR)
+        else:
+            head = b''
+        compression = DecompressedReader.compression(head, path)
+        if compression is None:
+            return source
+        try:
+            return DecompressedReader(source, compression, self.clOptions.live)
+        except OSError:
+            if path is not None:
+                source.close()
+            raise DecompressorUnavailable('{} input needs the \'zstandard\' module or the \'zstd\' command'
+                                          .format(compression)) from None
+
+
+    def queries(self, source):
+        # Yields every query of 'source' (see 'open_source') with its filtered and ranked hits, in input order and
+        # one at a time in this process. Queries of tabular results have their qseqid as 'id'. The input is closed
+        # once it has been read, unless it is an uncompressed file object. See 'filter_queries'.
+        results_in = self.open_source(source)
+        try:
+            if self.clOptions.fileformat == "XML":
+                for query in self.stats.timed(self.iterate_xml(results_in), 'read'):
+                    yield self.parse_iteration(query)
+            else:
+                for chunk in self.stats.timed(self.iterate_tab(results_in), 'read'):
+                    if isinstance(chunk, TabQuery):
+                        queries = [(chunk.qseqid, self.tab_query_hits(chunk))]
+                    else:
+                        queries = self.stats.timed(self.extract_tab_lines(chunk), 'parse')
+                    for qseqid, hits in queries:
+                        cur_query = Query()
+                        cur_query.id = qseqid
+                        with self.stats.stage('filter'):
+                            hits = self.apply_thresholds(hits)
+                        with self.stats.stage('rank'):
+                            cur_query.hits = HitRanker(self.clOptions).rank(hits)
+                        yield cur_query
+        finally:
+            if results_in is not source:
+                results_in.close()
+
+
+    def merge_shards(self):
+        # Concatenates the results of shards 1 to N into the output files, in shard order. The column header line
+        # of each file is kept from the first shard only.
+        n = self.clOptions.merge
+        suffixes = self.output_suffixes()
+        missing = [shard_output(self.clOptions.output, k, n) + suffix
+                   for k in range(1, n + 1) for suffix in suffixes
+                   if not os.path.exists(shard_output(self.clOptions.output, k, n) + suffix)]
+        if len(missing) != 0:
+            print('\n***  Shard results missing: {}  ***\n'.format(', '.join(missing)))
+            sys.exit(1)
+
+        for suffix in suffixes:
+            merged = ResultAppender(self.clOptions.output + suffix, self.clOptions)
+            try:
+                for k in range(1, n + 1):
+                    merged.append(shard_output(self.clOptions.output, k, n) + suffix)
+            finally:
+                merged.close()
+
+
+    def output_suffixes(self):
+        # File name suffixes of all the result files of a run: those of every sweep profile, or just the three
+        suffixes = result_suffixes(self.clOptions)
+        if self.clOptions.sweep != None:
+            suffixes = tuple('.' + profile.name + suffix for profile in self.clOptions.sweep for suffix in suffixes)
+        return suffixes
+
+
+    # In files mode large uncompressed files are split into shards of at least this many bytes
+    SPLIT_SIZE = 32 << 20
+
+    def process_files(self):
+        # Files mode ('--files'): the files are filtered by one pool of '--parallel' worker processes that lives for
+        # the whole set. A worker handles a whole file on its own, so there is no hand-off per query. The largest files
+        # are started first so the set does not end waiting on one big file. At most '--concurrentfiles' files are in
+        # progress at once. Large uncompressed files are split into shards (see ShardIndex) so several workers share
+        # them, and the shard results are concatenated once all shards are done. With '--mergeoutput' the results of
+        # each file are appended to one set of output files in the order the files are listed, as soon as the files
+        # before them are done. A line of progress is printed as each file is done and a summary at the end.
+        options = self.clOptions
+        files = options.files
+        sizes = [os.path.getsize(path) for path in files]
+        suffixes = self.output_suffixes()
+        if options.mergeoutput:
+            parts = options.output + '.parts'
+            os.makedirs(parts, exist_ok=True)
+            outputs = [os.path.join(parts, str(i)) for i in range(len(files))]
+        else:
+            if options.output != None:
+                os.makedirs(options.output, exist_ok=True)
+            outputs = [options.file_output(path) for path in files]
+
+        piece = max(sum(sizes) // (2 * options.parallel), self.SPLIT_SIZE)
+        shards = [1] * len(files)
+        tasks = deque()
+        for i in sorted(range(len(files)), key=lambda i: -sizes[i]):
+            if options.parallel > 1 and sizes[i] > piece and DecompressedReader.file_compression(files[i]) is None:
+                shards[i] = min(options.parallel, -(-sizes[i] // piece))
+            n = shards[i]
+            tasks.extend((i, (k, n) if n > 1 else None) for k in range(1, n + 1))
+
+        names = [''] if options.sweep == None else ['.' + profile.name for profile in options.sweep]
+        left = list(shards)                 # Tasks of each file not done yet
+        rows = [[[0, 0] for name in names] for path in files]
+        errors = [None] * len(files)
+        started = [None] * len(files)
+        done = queue.Queue()
+        complete = 0
+        merged = None
+        merge_next = 0
+        start = perf_counter()
+
+        pool = None
+        if options.parallel > 1:
+            from multiprocessing import Pool
+            with self.stats.stage('pool'):
+                pool = Pool(options.parallel)
+        try:
+            if options.mergeoutput:
+                merged = [ResultAppender(options.output + suffix, options) for suffix in suffixes]
+            active = set()
+            running = 0
+            while len(tasks) != 0 or running != 0:
+                # Start tasks, of files already in progress or of new files while there is room for them
+                while len(tasks) != 0 and running < 2 * options.parallel:
+                    i, shard = tasks[0]
+                    if i not in active:
+                        if len(active) >= options.concurrentfiles:
+                            break
+                        active.add(i)
+                        started[i] = perf_counter()
+                        if shard is not None:
+                            ShardIndex.load_or_build(files[i], options.fileformat, options.indexstep)
+                    tasks.popleft()
+                    self.start_file_task(pool, done, i, shard, options.for_file(files[i], outputs[i], shard))
+                    running += 1
+
+                with self.stats.stage('wait'):
+                    i, shard, result, error = done.get()
+                running -= 1
+                left[i] -= 1
+                if error is not None:
+                    errors[i] = error
+                else:
+                    written, stats = result
+                    self.stats.merge(stats)
+                    for totals, (name, counts) in zip(rows[i], written):
+                        totals[0] += counts[0]
+                        totals[1] += counts[1]
+                if left[i] != 0:
+                    continue
+
+                # All the tasks of the file are done
+                active.discard(i)
+                complete += 1
+                with self.stats.stage('write'):
+                    self.finish_file(outputs[i], shards[i], suffixes, errors[i] is None)
+                status = 'failed: {}'.format(errors[i]) if errors[i] is not None else '{} hits'.format(
+                    sum(counts[0] for counts in rows[i]))
+                print('[{}/{}] {} ({:.1f} MB, {:.2f}s) {}'.format(complete, len(files), files[i], sizes[i] / 1e6,
+                      perf_counter() - started[i], status), file=sys.stderr)
+                if merged is not None:
+                    with self.stats.stage('write'):
+                        while merge_next < len(files) and left[merge_next] == 0:
+                            if errors[merge_next] is None:
+                                for output, suffix in zip(merged, suffixes):
+                                    output.append(outputs[merge_next] + suffix)
+                                    os.remove(outputs[merge_next] + suffix)
+                            merge_next += 1
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if merged is not None:
+                for output in merged:
+                    output.close()
+        if pool is not None:
+            with self.stats.stage('pool'):
+                pool.close()
+                pool.join()
+        if options.mergeoutput:
+            shutil.rmtree(parts, ignore_errors=True)
+
+        # Summary
+        if options.mergeoutput:
+            for j, name in enumerate(names):
+                self.written.append((options.output + name, [sum(file_rows[j][0] for file_rows in rows),
+                                                              sum(file_rows[j][1] for file_rows in rows)]))
+        else:
+            for i in range(len(files)):
+                if errors[i] is None:
+                    self.written.extend((outputs[i] + name, counts) for name, counts in zip(names, rows[i]))
+        failed = [files[i] for i in range(len(files)) if errors[i] is not None]
+        seconds = perf_counter() - start
+        print('{} files ({:.1f} MB) in {:.1f}s: {:.1f} MB/s, {:.1f} files/s, {} hits and {} queries without hits '
+              'written{}'.format(len(files) - len(failed), sum(sizes) / 1e6, seconds, sum(sizes) / 1e6 / seconds,
+                                 len(files) / seconds, sum(counts[0] for file_rows in rows for counts in file_rows),
+                                 sum(counts[1] for file_rows in rows for counts in file_rows),
+                                 ', {} failed'.format(len(failed)) if len(failed) != 0 else ''), file=sys.stderr)
+        if len(failed) != 0:
+            print('\n***  Files that could not be processed: {}  ***\n'.format(', '.join(failed)))
+            self.failed = True
+
+
+    def start_file_task(self, pool, done, i, shard, config):
+        # Runs a file (or shard) task of files mode in the pool, or right away without one. Its result goes to
+        # 'done' with the file and shard it belongs to.
+        if pool is None:
+            try:
+                done.put((i, shard, filter_file(config), None))
+            except Exception as error:
+                done.put((i, shard, None, error))
+            return
+        pool.apply_async(filter_file, (config,), callback=lambda result: done.put((i, shard, result, None)),
+                         error_callback=lambda error: done.put((i, shard, None, error)))
+
+
+    def finish_file(self, output, n, suffixes, succeeded):
+        # Concatenates the results of the 'n' shards of a file of files mode, which are then removed, as are the
+        # results of a file that failed
+        for suffix in suffixes:
+            if succeeded and n > 1:
+                merged = ResultAppender(output + suffix, self.clOptions)
+                try:
+                    for k in range(1, n + 1):
+                        merged.append(shard_output(output, k, n) + suffix)
+                finally:
+                    merged.close()
+            paths = [shard_output(output, k, n) + suffix for k in range(1, n + 1)] if n > 1 else []
+            if not succeeded:
+                paths.append(output + suffix)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+    # <Hit> elements are taken out of the tree this many at a time as they are read (see 'iterate_xml'). Small
+    # batches are freed before the garbage collector moves them to its oldest generation, which would otherwise
+    # trigger frequent full collections on queries with many hits. Raw <Iteration> elements larger than RAW_TREE
+    # bytes are read the same way (see 'element').
+    HIT_ELEMENTS = 32
+    RAW_TREE = 4 << 20
+
+    def iterate_xml(self, source):
+        # Yields every <Iteration> element of the BLAST XML file once it has been completely read.
+        # After the caller is done with a query it is cleared and detached from <BlastOutput_iterations>, so the
+        # partially built tree never holds more than the query currently being processed. The tree of a query with
+        # many hits is bounded as well: every HIT_ELEMENTS <Hit> elements are turned into Hits (kept in a HitRuns,
+        # which spills to disk past '--spilllimit') and dropped from the tree as it is read.
+        iterations = None
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'BlastOutput_iterations':
+                    iterations = elem
+                elif elem.tag == 'Iteration':
+                    iteration = elem
+                elif elem.tag == 'Iteration_hits':
+                    hits = elem
+                    ended = 0
+            elif elem.tag == 'Hit':
+                # The parser runs ahead of the events, so only the <Hit> elements that have ended are complete. They
+                # are the first children, the ones before were taken already.
+                ended += 1
+                if ended >= self.HIT_ELEMENTS:
+                    self.take_hits(iteration, hits, ended)
+                    ended = 0
+            elif elem.tag == 'Iteration':
+                yield elem
+                self.read_hits.pop(elem, None)
+                elem.clear()
+                if iterations is not None:
+                    iterations.remove(elem)
+
+
+    def take_hits(self, iteration, hits, n):
+        # Moves the first 'n' <Hit> elements out of <Iteration_hits>, as Hits for 'extract_iteration'
+        read = self.read_hits.get(iteration)
+        if read is None:
+            read = self.read_hits[iteration] = HitRuns(self.clOptions.spilllimit)
+        for hit in hits[:n]:
+            read.extend(self.extract_hit(hit))
+        del hits[:n]
+
+
+    def iterate_xml_raw(self, source):
+        # Yields the raw bytes of every <Iteration> element without building a tree, so parsing can be left to the
+        # worker processes.
+        splitter = IterationSplitter()
+        read = self.reader(source)
+        while True:
+            data = read(1 << 20)
+            if not data:
+                break
+            for raw, end in zip(splitter.feed(data), splitter.ends):
+                if self.checkpoint is not None:
+                    self.checkpoint.read(self.input_start + end, Checkpoint.iteration_num(raw))
+                yield raw
+        splitter.close()
+
+
+    def element(self, raw):
+        # The element of a raw <Iteration> (see 'iterate_xml_raw'). Building it is timed as part of reading. Large
+        # ones are read like the whole file is, so their tree stays bounded.
+        with self.stats.stage('read'):
+            if len(raw) > self.RAW_TREE:
+                return next(self.iterate_xml(io.BytesIO(raw)))
+            return ET.fromstring(raw)
+
+
+    def parse_iteration(self, query):
+        # Extracts the query from a single <Iteration> element and keeps its top hits
+        with self.stats.stage('parse'):
+            cur_query, hits = self.extract_iteration(query)
+
+        # Order the hits that conform to the thresholds and keep the top hits
+        with self.stats.stage('filter'):
+            hits = self.apply_thresholds(hits)
+        with self.stats.stage('rank'):
+            cur_query.hits = HitRanker(self.clOptions).rank(hits)
+        return cur_query
+
+
+    def cache_iteration(self, query):
+        # Column values of the query of an <Iteration> element with all of its hits, for the parse cache
+        with self.stats.stage('parse'):
+            return CacheBuilder.iteration_columns([self.extract_iteration(query)])
+
+
+    def extract_iteration(self, query):
+        # Extracts the query and all of its hits from a single <Iteration> element, before any threshold is applied.
+        # All values are extracted for easy editing of the code, not all are used here. If another value is needed
+        # simply add another 'cur.find('VALUES_XML-TAG').text' in the desired position of code.
+        cur_query = Query()
+        cur_query.num = query.find('Iteration_iter-num').text
+        cur_query.def_ = query.find('Iteration_query-def').text
+        cur_query.length = query.find('Iteration_query-len').text
+
+        # The hits of <Hit> elements already taken out of the tree come first (see 'iterate_xml'). When there are
+        # more than '--spilllimit' of them they stay in a HitRuns rather than a list.
+        hits = self.read_hits.pop(query, None)
+        if hits is not None:
+            hits = hits.contents()
+        else:
+            hits = []
+        for hit in query.findall('./Iteration_hits/Hit'):
+            hits.extend(self.extract_hit(hit))
+        return cur_query, hits
+
+
+    def extract_hit(self, hit):
+        # The hits of a single <Hit> element, one for each of its HSPs
+        # The subject is interned, its deflevel is only counted the first time it is seen (see SubjectTable)
+        subject = self.subjects.get(hit.find('Hit_id').text, hit.find('Hit_def').text,
+                                    hit.find('Hit_accession').text, hit.find('Hit_len').text)
+
+        hits = []
+        for hsp in hit.findall('./Hit_hsps/Hsp'):
+            # Each hsp is treated as a separate hit in the list, all of them share the values of the subject.
+            cur_hit = Hit(subject,
+                          float(hsp.find('Hsp_bit-score').text),
+                          int(hsp.find('Hsp_score').text),
+                          float(hsp.find('Hsp_evalue').text),
+                          int(hsp.find('Hsp_query-from').text),
+                          int(hsp.find('Hsp_query-to').text),
+                          int(hsp.find('Hsp_hit-from').text),
+                          int(hsp.find('Hsp_hit-to').text),
+                          int(hsp.find('Hsp_query-frame').text),
+                          int(hsp.find('Hsp_identity').text),
+                          int(hsp.find('Hsp_align-len').text),
+                          int(hsp.find('Hsp_positive').text))
+
+            # Calculate the %identity and %conserved by using the align length and identity/positive data
+            cur_hit.p_identity = float("%.1f"%(100 * cur_hit.identity / cur_hit.align_len))
+            cur_hit.p_conserved = float("%.1f"%(100 * cur_hit.positive / cur_hit.align_len))
+            hits.append(cur_hit)
+        return hits
+
+
+    def apply_thresholds(self, hits, options=None):
+        # Applies the thresholds (of 'options', the command line by default) to all the hits of a query at once and
+        # returns those that conform. If changes to the thresholds are desired (add more ect.) this is where do do it.
+        if options is None:
+            options = self.clOptions
+        if not isinstance(hits, list):
+            return self.stream_thresholds(hits, options)
+        evalue = options.evalue
+        bitscore = options.bitscore
+        definition = options.definition
+        identity = options.identity
+        kept = [hit for hit in hits
+                if hit.evalue <= evalue
+                and hit.bitscore >= bitscore
+                and hit.subject.deflevel >= definition
+                and hit.p_identity >= identity]
+        if self.stats.enabled:
+            self.stats.count_thresholds(hits, len(kept), options)
+        return kept
+
+
+    def stream_thresholds(self, hits, options):
+        # 'apply_thresholds' for the hits of a query with too many hits to hold (a HitRuns), yielding the hits that
+        # conform as they are read so they can go straight to HitRanker
+        evalue = options.evalue
+        bitscore = options.bitscore
+        definition = options.definition
+        identity = options.identity
+        kept = 0
+        for hit in hits:
+            if (hit.evalue <= evalue
+                    and hit.bitscore >= bitscore
+                    and hit.subject.deflevel >= definition
+                    and hit.p_identity >= identity):
+                kept += 1
+                yield hit
+        if self.stats.enabled:
+            self.stats.count_thresholds(hits, kept, options)
+
+
+    def write_query(self, cur_query):
+        with self.stats.stage('write'):
+            self.output.write_query(cur_query)
+
+
+    def parseTab(self):
+        # The blast tabular output format (outfmt 6) is read in large chunks that end on a query boundary and each
+        # chunk is filtered and ranked as a whole (see TabularChunk). Hit rows are written exactly as they appear in
+        # the input. If using parsing options that rely on the definition of a hit, enable the column 'salltitles' in
+        # -outfmt 6 of BLAST e.g. '-outfmt "6 std salltitles"'
+        self.read_tab(self.process_tab_chunk, process_batch, self.write_block)
+
+
+    def read_tab(self, parse, process, write):
+        # Runs 'parse' on every chunk of the input and hands each result to 'write', in input order. When running
+        # in parallel, chunks are handled by 'process' in the workers.
+        try:
+            results_in = self.open_input()
+        except OSError:
+            traceback.print_exc()
+            print('\n***  Tabular file could not be parsed. Check the BLAST results file  ***\n')
+            sys.exit(1)
+
+        if self.checkpoint is not None:
+            write = self.checkpoint.wrap(write)
+        chunks = self.stats.timed(self.iterate_tab(results_in), 'read')
+        try:
+            if self.clOptions.parallel > 1:
+                self.run_parallel(([chunk] for chunk in chunks), write, process)
+            else:
+                for chunk in chunks:
+                    write(parse(chunk))
+        except DecompressionError:
+            traceback.print_exc()
+            print('\n***  Tabular file could not be parsed. Check the BLAST results file  ***\n')
+            sys.exit(1)
+
+
+    def iterate_tab(self, results_in):
+        # Yields chunks of about '--chunksize' bytes of complete lines. Every chunk ends on a query boundary, so
+        # all the lines of a query (qseqid, the first column) are in the same chunk. Comment lines and blank lines are
+        # dropped. A query with more than '--spilllimit' rows is not carried over to the next chunk: from then on its
+        # rows are read into a HitRuns as they come and it is yielded on its own as a TabQuery.
+        carry = b''
+        spilled = None
+        offset = self.input_start
+        read = self.reader(results_in)
+        limit = self.clOptions.spilllimit
+        while True:
+            block = read(self.clOptions.chunksize)
+            if not block:
+                break
+            offset += len(block)
+            data = carry + block
+            complete = data.rfind(b'\n') + 1
+            if spilled is not None:
+                start = self.spill_tab_rows(spilled, data, complete)
+                if start == complete and not spilled.whole():
+                    carry = data[complete:]
+                    continue
+                yield self.tab_query(spilled, offset - (len(data) - start))
+                spilled = None
+                data = data[start:]
+                complete -= start
+            cut = self.last_query_start(data, complete)
+            if self.clOptions.live and cut < complete and self.declared_rows(data, cut) == data.count(b'\n', cut, complete):
+                # All the rows of the last query are there, it does not have to wait for the next query to start
+                cut = complete
+            if cut > 0:
+                yield self.tab_chunk(data[:cut], offset - (len(data) - cut))
+            carry = data[cut:]
+            if limit != 0 and carry.count(b'\n') > limit and carry.find(b'\t', 0, carry.find(b'\n')) > 0:
+                spilled = TabQuery(carry[:carry.find(b'\t')].decode(), limit,
+                                   self.declared_rows(data, cut) if self.clOptions.live else None)
+                carry = carry[self.spill_tab_rows(spilled, carry, complete - cut):]
+        if spilled is not None:
+            # Only the last line can be left, if it has no line end
+            rest = carry if carry.endswith(b'\n') or len(carry) == 0 else carry + b'\n'
+            start = self.spill_tab_rows(spilled, rest, len(rest))
+            yield self.tab_query(spilled, offset - max(len(carry) - start, 0))
+            carry = rest[start:]
+        if len(carry) != 0:
+            yield self.tab_chunk(carry if carry.endswith(b'\n') else carry + b'\n', offset)
+
+
+    def spill_tab_rows(self, spilled, data, complete):
+        # Adds the rows of a TabQuery at the start of the complete lines 'data[:complete]' to its HitRuns. Returns the
+        # position just past them.
+        prefix = spilled.prefix
+        if (complete != 0 and data.startswith(prefix)
+                and data.count(b'\n' + prefix, 0, complete) == data.count(b'\n', 0, complete - 1)):
+            # Every line is a row of the query, which is the usual case
+            end = complete
+        else:
+            end = 0
+            while end < complete and data.startswith(prefix, end):
+                end = data.index(b'\n', end) + 1
+        if end != 0:
+            lines = data[:end - 1]
+            if b'\r' in lines:
+                lines = lines.replace(b'\r\n', b'\n').rstrip(b'\r')
+            spilled.rows.extend(lines.split(b'\n'))
+        return end
+
+
+    def tab_query(self, spilled, end):
+        # A TabQuery as yielded by 'iterate_tab', once all of its rows are read. 'end' is the input offset just past
+        # it.
+        if self.checkpoint is not None:
+            self.checkpoint.read(end, spilled.qseqid)
+        return spilled
+
+
+    def declared_rows(self, data, start):
+        # The number of rows of the query starting at 'start' given by the comment line before it, which BLAST writes
+        # with '-outfmt 7' ('# 3 hits found'), or None
+        if start == 0:
+            return None
+        line = data[data.rfind(b'\n', 0, start - 1) + 1:start].rstrip()
+        if not (line.startswith(b'# ') and line.endswith(b' hits found')):
+            return None
+        try:
+            return int(line[2:-len(b' hits found')])
+        except ValueError:
+            return None
+
+
+    def reader(self, source):
+        # The function used to read the input. In live mode reads return whatever data is available (at least one
+        # byte) instead of waiting for a full block, so results are not held back while BLAST is still running.
+        if self.clOptions.live:
+            return source.read1
+        return source.read
+
+
+    def tab_chunk(self, data, end):
+        # A chunk of complete lines as yielded by 'iterate_tab', with CRLF line ends made plain. 'end' is the input
+        # offset just past the chunk.
+        if self.checkpoint is not None:
+            self.checkpoint.read(end, Checkpoint.last_qseqid(data))
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n')
+        return data
+
+
+    def last_query_start(self, data, complete):
+        # Position of the first line of the last query among the complete lines 'data[:complete]'
+        if complete == 0:
+            return 0
+        start = data.rfind(b'\n', 0, complete - 1) + 1
+        tab = data.find(b'\t', start, complete)
+        qseqid = data[start:tab if tab >= 0 else complete - 1] + b'\t'
+        while start > 0:
+            previous = data.rfind(b'\n', 0, start - 1) + 1
+            if not data.startswith(qseqid, previous):
+                break
+            start = previous
+        return start
+
+
+    def process_tab_chunk(self, data):
+        if isinstance(data, TabQuery):
+            return self.rank_tab_query(data, self.clOptions)
+        chunk, data = self.tabular_chunk(data)
+        if chunk is not None:
+            return chunk.block(self.clOptions, self.stats)
+        return self.process_tab_lines(data)
+
+
+    def cache_tab_chunk(self, data):
+        # Column values of a chunk for the parse cache (see CacheBuilder)
+        if isinstance(data, TabQuery):
+            with self.stats.stage('parse'):
+                return CacheBuilder.tab_columns([(data.qseqid, self.tab_query_hits(data))])
+        chunk, data = self.tabular_chunk(data)
+        with self.stats.stage('parse'):
+            if chunk is not None:
+                return chunk.cache_columns()
+            return CacheBuilder.tab_columns(self.extract_tab_lines(data))
+
+
+    def tabular_chunk(self, data):
+        # The chunk as a regular TabularChunk, or None if it has to be handled line by line. Comment lines are
+        # dropped from the returned data.
+        if load_optional('numpy', 'np'):
+            with self.stats.stage('parse'):
+                chunk = TabularChunk(data, self.clOptions.type)
+                if chunk.comments.any():
+                    data = chunk.without_comments()
+                    chunk = TabularChunk(data, self.clOptions.type)
+            if chunk.regular:
+                return chunk, data
+        return None, data
+
+
+    def process_tab_lines(self, data):
+        # Line by line counterpart of TabularChunk, used without NumPy or for chunks with a varying number of columns
+        return self.rank_tab_queries(self.stats.timed(self.extract_tab_lines(data), 'parse'), self.clOptions)
+
+
+    def rank_tab_queries(self, queries, options):
+        # Filters and ranks the queries returned by 'extract_tab_lines' with the thresholds and order of 'options'
+        hits = []
+        header = []
+        nohits = []
+        ranker = HitRanker(options)
+        for qseqid, cur_hits in queries:
+            with self.stats.stage('filter'):
+                cur_hits = self.apply_thresholds(cur_hits, options)
+            with self.stats.stage('rank'):
+                cur_hits = ranker.rank(cur_hits)
+            self.format_tab_query(qseqid, cur_hits, hits, header, nohits)
+        return TabBlock(''.join(hits), ''.join(header), ''.join(nohits))
+
+
+    def rank_tab_query(self, query, options):
+        # Filters and ranks a TabQuery with the thresholds and order of 'options'. Its rows are read from the HitRuns
+        # as they are filtered, and ranked in runs as well when there are more than '--spilllimit' to order.
+        with self.stats.stage('rank'):
+            return TabRuns(query.qseqid, TabRowRanker(options).rank(self.tab_query_rows(query, options)))
+
+
+    def tab_query_hits(self, query):
+        # All the Hits of a TabQuery, for the library API and the parse cache. They are kept in a HitRuns too.
+        hits = HitRuns(self.clOptions.spilllimit)
+        for data in query.batches():
+            for qseqid, cur_hits in self.extract_tab_lines(data):
+                hits.extend(cur_hits)
+        return hits.contents()
+
+
+    def tab_query_rows(self, query, options):
+        # Yields the rows of a TabQuery that conform to the thresholds of 'options' (see 'apply_thresholds') as
+        # (evalue, bitscore, p_identity, deflevel, line) tuples. The deflevel is counted in the salltitles column
+        # like SubjectTable does. With NumPy the values of each batch of rows are converted a column at a time.
+        delimiter = ';' if self.clOptions.type == 'n' else '>'
+        evalue = options.evalue
+        bitscore = options.bitscore
+        definition = options.definition
+        identity = options.identity
+        stats = self.stats
+        for data in query.batches():
+            chunk, data = self.tabular_chunk(data)
+            if chunk is not None:
+                columns = [chunk.column(name) for name in ('evalue', 'bitscore', 'p_identity', 'deflevel')]
+                masks = [('dropped_evalue', columns[0] <= evalue), ('dropped_bitscore', columns[1] >= bitscore),
+                         ('dropped_identity', columns[2] >= identity), ('dropped_deflevel', columns[3] >= definition)]
+                keep = masks[0][1] & masks[1][1] & masks[2][1] & masks[3][1]
+                for counter, mask in masks:
+                    stats.count(counter, len(mask) - int(np.count_nonzero(mask)))
+                rows = np.flatnonzero(keep)
+                stats.count('hsps_kept', len(rows))
+                lines = data.decode().split('\n')
+                yield from zip(*[column[rows].tolist() for column in columns], [lines[j] for j in rows.tolist()])
+                continue
+            for line in data.decode().split('\n')[:-1]:
+                row = line.split('\t')
+                hit = (float(row[10]), float(row[11]), float(row[2]),
+                       1 + row[12].count(delimiter) if len(row) >= 13 else 0, line)
+                if hit[0] <= evalue and hit[1] >= bitscore and hit[3] >= definition and hit[2] >= identity:
+                    stats.count('hsps_kept')
+                    yield hit
+                elif stats.enabled:
+                    stats.count('dropped_evalue', not hit[0] <= evalue)
+                    stats.count('dropped_bitscore', not hit[1] >= bitscore)
+                    stats.count('dropped_identity', not hit[2] >= identity)
+                    stats.count('dropped_deflevel', not hit[3] >= definition)
+        stats.count('queries')
+        stats.count('hsps', len(query))
+
+
+    def extract_tab_lines(self, data):
+        # Yields the qseqid and all the hits of every query in a chunk of tabular lines, before any threshold is applied
+        cur_id = None
+        cur_hits = []
+        subject = Subject()
+        for line in data.decode().split('\n'):
+            if len(line) == 0 or line[0] == '#' or line.isspace():
+                continue
+            row = line.split('\t')
+            if row[0] != cur_id:
+                if cur_id is not None:
+                    yield cur_id, cur_hits
+                cur_id = row[0]
+                cur_hits = []
+
+            # The HSPs of a subject are on consecutive lines and share one Subject
+            def_ = row[12] if len(row) >= 13 else None
+            if row[1] != subject.id or def_ != subject.def_:
+                subject = self.subjects.get(row[1], def_)
+
+            cur_hits.append(Hit(subject, float(row[11]), evalue=float(row[10]), p_identity=float(row[2]), line=line))
+        if cur_id is not None:
+            yield cur_id, cur_hits
+
+
+    def format_tab_query(self, qseqid, top_hits, hits, header, nohits):
+        if len(top_hits) != 0:
+            for hit in top_hits:
+                hits.append(hit.line + '\n')
+                header.append('{}\t{}\n'.format(qseqid, hit.id))
+        else:
+            nohits.append("{}\tNo hits found.\n".format(qseqid))
+
+
+    def write_block(self, block):
+        with self.stats.stage('write'):
+            for part in block.blocks():
+                self.output.write_block(part)
+
+
+    def sweep(self):
+        # Sweep mode: every query (or chunk of tabular lines) is parsed once and then filtered and ranked with each
+        # of the sweep profiles in turn. The results of each profile go to their own output files.
+        if self.clOptions.fileformat == "XML":
+            self.read_xml(self.sweep_iteration, sweep_batch, self.write_sweep_queries)
+        else:
+            self.read_tab(self.sweep_tab_chunk, sweep_batch, self.write_sweep_blocks)
+
+
+    def sweep_iteration(self, query):
+        # The query of an <Iteration> element with its top hits for each sweep profile
+        with self.stats.stage('parse'):
+            cur_query, hits = self.extract_iteration(query)
+        results = []
+        for profile in self.clOptions.sweep:
+            swept = Query()
+            swept.num = cur_query.num
+            swept.def_ = cur_query.def_
+            swept.length = cur_query.length
+            with self.stats.stage('filter'):
+                kept = self.apply_thresholds(hits, profile)
+            with self.stats.stage('rank'):
+                swept.hits = HitRanker(profile).rank(kept)
+            results.append(swept)
+        return results
+
+
+    def sweep_tab_chunk(self, data):
+        # The results of a chunk of tabular lines for each sweep profile
+        if isinstance(data, TabQuery):
+            return [self.rank_tab_query(data, profile) for profile in self.clOptions.sweep]
+        chunk, data = self.tabular_chunk(data)
+        if chunk is not None:
+            return [chunk.block(profile, self.stats) for profile in self.clOptions.sweep]
+        queries = list(self.stats.timed(self.extract_tab_lines(data), 'parse'))
+        return [self.rank_tab_queries(queries, profile) for profile in self.clOptions.sweep]
+
+
+    def write_sweep_queries(self, results):
+        with self.stats.stage('write'):
+            for output, cur_query in zip(self.outputs, results):
+                output.write_query(cur_query)
+
+
+    def write_sweep_blocks(self, results):
+        with self.stats.stage('write'):
+            for output, block in zip(self.outputs, results):
+                for part in block.blocks():
+                    output.write_block(part)
+
+
+    def batches(self, units):
+        # Groups queries into lists of '--batchsize' so each hand-off to a worker process carries enough work
+        # to outweigh the cost of pickling it.
+        batch = []
+        for unit in units:
+            batch.append(unit)
+            if len(batch) >= self.clOptions.batchsize:
+                yield batch
+                batch = []
+        if len(batch) != 0:
+            yield batch
+
+
+    def run_parallel(self, batches, write, process=None):
+        # Batches of queries (or chunks of tabular lines) are sent to a single long-lived pool of worker processes
+        # which parse, filter and rank them. Results are collected in the order the batches were submitted, so the
+        # output files are the same as those of a sequential run. At most two batches per worker are in flight to
+        # keep memory bounded. With '--stats' each batch comes back with what the worker recorded while processing it.
+        if process is None:
+            process = process_batch
+        with self.stats.stage('pool'):
+            from multiprocessing import Pool
+            pool = Pool(self.clOptions.parallel, initializer=init_worker, initargs=(self.clOptions,))
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(pool.apply_async(run_batch, (process, batch)))
+                if len(pending) >= 2 * self.clOptions.parallel:
+                    self.write_batch(pending.popleft(), write)
+            while len(pending) != 0:
+                self.write_batch(pending.popleft(), write)
+        except:
+            pool.terminate()
+            raise
+        with self.stats.stage('pool'):
+            pool.close()
+            pool.join()
+
+
+    def write_batch(self, pending, write):
+        with self.stats.stage('wait'):
+            results, stats = pending.get()
+        self.stats.merge(stats)
+        for result in results:
+            write(result)
+
+
+    def order_hits(self, cur_query):
+        # Orders a complete list of hits and keeps the top hits (see HitRanker)
+        cur_query.hits = HitRanker(self.clOptions).rank(cur_query.hits)
+
+
+# Worker processes build their own BLASTQC from the parent's options once, when the pool starts.
+worker = None
+
+def init_worker(options):
+    global worker
+    worker = BLASTQC(options)
+
+
+def run_batch(process, batch):
+    # Runs 'process' on a batch and returns its results with what the worker recorded for '--stats'
+    return process(batch), worker.stats.take()
+
+
+def filter_file(options):
+    # Runs one file (or shard of a file) of files mode in a worker process. Returns the rows written to each output
+    # and what was recorded for '--stats'.
+    qc = BLASTQC(options)
+    qc.outputs = []
+    try:
+        qc.run_filters()
+    except SystemExit:
+        raise RuntimeError('{} could not be processed'.format(options.filename)) from None
+    return [(output.name, output.rows) for output in qc.outputs], qc.stats.take()
+
+
+def process_batch(batch):
+    if worker.clOptions.fileformat == "XML":
+        return [worker.parse_iteration(worker.element(raw)) for raw in batch]
+    return [worker.process_tab_chunk(chunk) for chunk in batch]
+
+
+def sweep_batch(batch):
+    # Like 'process_batch', but returns the results of every sweep profile
+    if worker.clOptions.fileformat == "XML":
+        return [worker.sweep_iteration(worker.element(raw)) for raw in batch]
+    return [worker.sweep_tab_chunk(chunk) for chunk in batch]
+
+
+def extract_batch(batch):
+    # Like 'process_batch', but returns the column values of every query with all of its hits, for building the
+    # parse cache
+    if worker.clOptions.fileformat == "XML":
+        queries = [worker.element(raw) for raw in batch]
+        with worker.stats.stage('parse'):
+            return [CacheBuilder.iteration_columns([worker.extract_iteration(query) for query in queries])]
+    return [worker.cache_tab_chunk(chunk) for chunk in batch]
+
+
+# Library use. BLAST-QC can be imported and run from Python with the options of a FilterConfig (or given by
+# keyword, as for FilterConfig):
+#
+#   import blastqc
+#   for query in blastqc.filter_queries('results.xml', fileformat='XML', type='n', evalue=1e-10, number=1):
+#       print(query.def_, [hit.id for hit in query.hits])
+#
+def filter_queries(source, config=None, **options):
+    # Yields every query of 'source' (the path of a results file or a binary file object, compressed or not) as a
+    # Query with its filtered and ranked hits, in input order. Queries without any hits left are yielded with an
+    # empty list. The hits of a query with more than '--spilllimit' hits to order are a HitRuns instead of a list,
+    # which has a length and can be iterated in the same way. Only the filter, order and input options are used:
+    # nothing is written and all the work is done in this process, as the queries are read.
+    if config is None:
+        config = FilterConfig(**options)
+    elif len(options) != 0:
+        raise TypeError('options cannot be given both as a FilterConfig and by keyword')
+    return BLASTQC(config).queries(source)
+
+
+def run(config=None, **options):
+    # Runs BLAST-QC like the command line does, writing the result files of the input file 'filename'
+    if config is None:
+        config = FilterConfig(**options)
+    elif len(options) != 0:
+        raise TypeError('options cannot be given both as a FilterConfig and by keyword')
+    BLASTQC(config).run()
+
+
+def main():
+    # The command line. A run that cannot read its input is reported with a message and exit code here, where the
+    # library raises instead.
+    try:
+        BLASTQC().run()
+    except DecompressorUnavailable as error:
+        print('\n***  {}  ***\n'.format(error))
+        sys.exit(1)
+
+
+# Taking off . . .
+if __name__ == '__main__':
+    main()
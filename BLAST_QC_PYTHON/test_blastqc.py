@@ -0,0 +1,119 @@
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import blastqc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, 'BLAST-QC.py')
+SAMPLE = os.path.join(HERE, '..', 'TESTCASES', 'sampleResults.xml')
+
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, SCRIPT] + list(args), capture_output=True, text=True)
+
+
+def read_text(path):
+    with open(path) as text:
+        return text.read()
+
+
+class FilesModeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name in ('a.xml', 'b.xml'):
+            shutil.copyfile(SAMPLE, os.path.join(self.directory, name))
+
+    def test_rerun_skips_own_results(self):
+        # The results written next to the files are not taken as input by a second run, whatever their format
+        for outformat in blastqc.FilterConfig.CHOICES['outformat']:
+            if outformat == 'parquet' and not blastqc.load_optional('pyarrow', 'pa'):
+                continue
+            with self.subTest(outformat=outformat):
+                for _ in range(2):
+                    result = run_cli('-fs', self.directory, '-ff', 'XML', '-t', 'n', '-p', '1', '-of', outformat)
+                    self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+                    self.assertIn('2 files', result.stderr)
+                    self.assertNotIn('failed', result.stderr)
+
+
+class CompressedInputTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_truncated_gzip(self):
+        # A truncated compressed file is reported as a results file that could not be parsed, with a nonzero exit
+        with open(SAMPLE, 'rb') as sample:
+            data = gzip.compress(sample.read())
+        path = os.path.join(self.directory, 'truncated.xml.gz')
+        with open(path, 'wb') as truncated:
+            truncated.write(data[:len(data) // 2])
+        for fileformat in ('XML', 'tab'):
+            for parallel in ('1', '2'):
+                with self.subTest(fileformat=fileformat, parallel=parallel):
+                    result = run_cli('-f', path, '-ff', fileformat, '-t', 'n', '-p', parallel,
+                                     '-o', os.path.join(self.directory, 'out'))
+                    self.assertNotEqual(result.returncode, 0)
+                    self.assertIn('could not be parsed', result.stdout)
+                    self.assertIn('DecompressionError', result.stderr)
+
+    def test_missing_decompressor(self):
+        # zstd input without a way to decompress it raises in the library, the command line reports it and exits 1
+        if blastqc.load_optional('zstandard') or shutil.which('zstd'):
+            self.skipTest('zstd input can be decompressed here')
+        path = os.path.join(self.directory, 'results.xml.zst')
+        with open(path, 'wb') as results:
+            results.write(b'\x28\xb5\x2f\xfd')
+        with self.assertRaises(blastqc.DecompressorUnavailable):
+            list(blastqc.filter_queries(path, fileformat='XML', type='n'))
+        result = run_cli('-f', path, '-ff', 'XML', '-t', 'n', '-p', '1', '-o', os.path.join(self.directory, 'out'))
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('needs the \'zstandard\' module', result.stdout)
+
+
+class SpillLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        rows = []
+        for qseqid, n in (('q1', 3), ('q2', 2000), ('q3', 5)):
+            for i in range(n):
+                rows.append('\t'.join([qseqid, 's{}'.format(i % 97), str(50 + i % 50), '100', '1', '0', '1', '100',
+                                       '1', '100', '{}e-{}'.format(1 + i % 9, i % 30), str(30 + i % 70),
+                                       'a;b' if i % 3 else 'a']))
+        self.path = os.path.join(self.directory, 'results.tsv')
+        with open(self.path, 'w') as results:
+            results.write('\n'.join(rows) + '\n')
+
+    def test_tabular_spill(self):
+        # A tabular query with more rows than '--spilllimit' is read into runs, with the same results as in memory
+        config = blastqc.FilterConfig(fileformat='tab', type='n', number=0, spilllimit=50, chunksize=4096)
+        qc = blastqc.BLASTQC(config)
+        with open(self.path, 'rb') as results:
+            spilled = [unit for unit in qc.iterate_tab(results) if isinstance(unit, blastqc.TabQuery)]
+        self.assertEqual([(query.qseqid, len(query)) for query in spilled], [('q2', 2000)])
+        self.assertNotEqual(spilled[0].rows.paths, [])
+
+        for options in (['-n', '0', '-or', 'e'], ['-n', '0', '-or', 'd', '-d', '2'], ['-n', '3', '-or', 'b'],
+                        ['-n', '0', '-or', 'e', '-er', '1e-10']):
+            for parallel in ('1', '2'):
+                with self.subTest(options=options, parallel=parallel):
+                    outputs = []
+                    for spill in (['-sl', '0'], ['-sl', '50', '-cs', '4096']):
+                        output = os.path.join(self.directory, 'out' + spill[1])
+                        result = run_cli('-f', self.path, '-ff', 'tab', '-t', 'n', '-p', parallel, '-o', output,
+                                         *(options + spill))
+                        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+                        outputs.append([read_text(output + suffix)
+                                        for suffix in ('.hits.txt', '.hits.header', '.nohits.txt')])
+                    self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,7 @@ python ../BLAST-QC.py --input sampleResults.xml --type n --output one.out/exampl
 python ../BLAST-QC.py -i sampleResults.xml -t n -o two.out/example_two.out --number 1 -or e
 
 #There! using a range value makes finding a good hit with acceptable definition info easier.
-python ../BLAST-QC.py -i sampleResults.xml -t n -o three.out/example_three.out -n 2 --erange .0005 -or e
+python ../BLAST_QC_PYTHON/BLAST-QC.py -f sampleResults.xml -ff XML -t n -o three.out/example_three.out -n 2 --erange .0005 -or e
 
 #Thresholds for lots of important values.
 python ../BLAST-QC.py -i sampleResults.xml -t n -o four.out/example_four.out -n 1 -or e --evalue .03 --bitscore 35 --description 1 --identity 60